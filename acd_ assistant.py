@@ -10,6 +10,7 @@ import tempfile
 import base64
 from io import BytesIO
 from PIL import Image
+from llm_cache import LLMCache
 
 # PDF processing
 import PyPDF2
@@ -127,7 +128,20 @@ if 'current_qa' not in st.session_state:
 if 'data_analysis' not in st.session_state:
     st.session_state.data_analysis = {}
 
-def query_ai(prompt, task_type="general", max_tokens=8192):
+@st.cache_resource
+def get_llm_cache():
+    """Gemini response cache shared across reruns and with api.py"""
+    return LLMCache(os.path.join(os.environ.get("CACHE_DIR", "cache"), "llm_cache.db"))
+
+# Map query_ai task types onto the cache's TTL classes
+CACHE_TASK_TYPES = {
+    "summarize": "summary",
+    "study_notes": "notes",
+    "qa": "qa",
+    "practice_questions": "quiz",
+}
+
+def query_ai(prompt, task_type="general", max_tokens=8192, bypass_cache=False):
     """Query Gemini API with the given prompt"""
     
     system_prompts = {
@@ -144,18 +158,18 @@ def query_ai(prompt, task_type="general", max_tokens=8192):
     
     try:
         model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(
-            full_prompt,
+        return get_llm_cache().generate(
+            model, full_prompt, f"query_ai.{task_type}", prompt,
+            task_type=CACHE_TASK_TYPES.get(task_type, "general"),
             generation_config=genai.GenerationConfig(
                 temperature=0.7,
                 top_p=0.95,
                 top_k=40,
                 max_output_tokens=max_tokens
-            )
+            ),
+            bypass=bypass_cache
         )
         
-        return response.text
-        
     except Exception as e:
         st.error(f"Error: {str(e)}")
         return "Error processing request."
@@ -1,23 +1,139 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Dict, Any, Optional
 import google.generativeai as genai
+import asyncio
 import json
+import logging
 import requests
 import time
 from pytube import YouTube
 from youtube_transcript_api import YouTubeTranscriptApi
-import graphviz
 import os
 import sys
 import re
+import shutil
+from transcript_store import TranscriptStore
+from llm_executor import LLMExecutor, TieredLLMExecutor
+from llm_governor import GovernedModel, LLMGovernor, LLMUnavailableError
+from model_router import ModelRouter
+from llm_cache import LLMCache
+from transcript_index import VIDEO_ID_PATTERN, TranscriptIndexStore, format_timestamp
+from summarizer import MapReduceSummarizer, estimate_tokens, build_reduce_prompt
+from batch_queue import BatchQueue
+from jobs import JobRunner, JobStore
+from singleflight import SingleFlight, normalize_text
+from metrics import Registry
+from response_shaping import json_response, select_fields
+from transcript import Transcript
+from transcript_search import PhraseIndex
+from structured_output import StructuredOutput
+from quiz_bank import QuizBank
+from graph_renderer import FORMATS, GraphRenderer
+from semantic_cache import SemanticCache, normalize_topic
+from chat_server import ChatHub, raise_open_file_limit
+from chat_pubsub import InProcessPubSub, RedisPubSub
+from blob_store import BlobStore, parse_byte_range, sniff_audio_type
+from chat_history import ChatHistory
 
 # Configure API keys
 GOOGLE_API_KEY = "**********************************"
 YOUTUBE_API_KEY = "**********************************"
 genai.configure(api_key=GOOGLE_API_KEY)
 
+# Cache settings
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+TRANSCRIPT_CACHE_TTL = int(os.environ.get("TRANSCRIPT_CACHE_TTL", 7 * 24 * 3600))
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.environ.get("TRANSCRIPT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Maximum number of Gemini calls running at once per worker
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+
+# Gemini flow control: quota errors and deadline timeouts shrink the
+# concurrency limit, retries stop at the deadline, and the circuit opens after
+# this many consecutive failures
+LLM_DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE_SECONDS", 90))
+LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", 5))
+LLM_CIRCUIT_OPEN_SECONDS = float(os.environ.get("LLM_CIRCUIT_OPEN_SECONDS", 30))
+
+# Model routing: small inputs go to the fast tier unless the task needs the
+# large one; failed validation on the fast tier retries on the large tier
+LLM_FAST_MODEL = os.environ.get("LLM_FAST_MODEL", "gemini-1.5-flash")
+LLM_LARGE_MODEL = os.environ.get("LLM_LARGE_MODEL", "gemini-1.5-pro")
+ROUTER_SMALL_INPUT_TOKENS = int(os.environ.get("ROUTER_SMALL_INPUT_TOKENS", 8000))
+ROUTER_LARGE_TASKS = os.environ.get("ROUTER_LARGE_TASKS", "learning_path,summary_reduce").split(",")
+# While a task is kept off the large tier for latency, one call per interval re-measures it
+ROUTER_PROBE_SECONDS = float(os.environ.get("ROUTER_PROBE_SECONDS", 60))
+
+# Map-reduce summarization settings for long transcripts
+LONG_TRANSCRIPT_TOKENS = int(os.environ.get("LONG_TRANSCRIPT_TOKENS", 24000))
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", 6000))
+SUMMARY_MAP_CONCURRENCY = int(os.environ.get("SUMMARY_MAP_CONCURRENCY", 4))
+
+# Batch ingestion settings; batch stages get their own limits so a large
+# batch cannot starve interactive requests of LLM slots
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+BATCH_TRANSCRIPT_CONCURRENCY = int(os.environ.get("BATCH_TRANSCRIPT_CONCURRENCY", 4))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 4))
+BATCH_RETENTION_SECONDS = int(os.environ.get("BATCH_RETENTION_SECONDS", 24 * 3600))
+
+# Async job mode settings
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 24 * 3600))
+JOB_MAX_WAIT_SECONDS = int(os.environ.get("JOB_MAX_WAIT_SECONDS", 60))
+# Workers heartbeat the jobs they run; jobs silent for three intervals are taken over by another worker
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", 10))
+
+# Quiz bank settings: questions generated per batch, pool cap per video and
+# the number of undealt questions below which a refill is scheduled
+QUIZ_BANK_BATCH_SIZE = int(os.environ.get("QUIZ_BANK_BATCH_SIZE", 15))
+QUIZ_BANK_MAX_SIZE = int(os.environ.get("QUIZ_BANK_MAX_SIZE", 60))
+QUIZ_BANK_LOW_WATER = int(os.environ.get("QUIZ_BANK_LOW_WATER", 5))
+
+# Learning path rendering: Graphviz runs in a process pool and is killed after the timeout
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_TIMEOUT_SECONDS = float(os.environ.get("RENDER_TIMEOUT_SECONDS", 10))
+
+# /resources serves cached recommendations for topics at least this similar (cosine)
+RESOURCE_SIMILARITY_THRESHOLD = float(os.environ.get("RESOURCE_SIMILARITY_THRESHOLD", 0.85))
+
+# Study room chat: frames queued per client before it is disconnected as too
+# slow, and limits on rooms, message length and audio size
+CHAT_SEND_QUEUE_SIZE = int(os.environ.get("CHAT_SEND_QUEUE_SIZE", 256))
+CHAT_MAX_ROOMS = int(os.environ.get("CHAT_MAX_ROOMS", 1000))
+CHAT_MAX_MESSAGE_CHARS = int(os.environ.get("CHAT_MAX_MESSAGE_CHARS", 4000))
+CHAT_MAX_AUDIO_BYTES = int(os.environ.get("CHAT_MAX_AUDIO_BYTES", 2 * 1024 * 1024))
+# Largest WebSocket frame; audio is uploaded in binary chunks of at most this size
+CHAT_MAX_FRAME_BYTES = int(os.environ.get("CHAT_MAX_FRAME_BYTES", 64 * 1024))
+CHAT_AUDIO_UPLOAD_TIMEOUT = float(os.environ.get("CHAT_AUDIO_UPLOAD_TIMEOUT", 60))
+# Disk space for stored audio clips; the oldest are deleted beyond it
+CHAT_AUDIO_STORE_MAX_BYTES = int(os.environ.get("CHAT_AUDIO_STORE_MAX_BYTES", 1024 * 1024 * 1024))
+# Room history: recent messages kept in memory per room, messages per history page,
+# how often queued messages are written and fsynced, and the log segment size
+CHAT_HISTORY_RING_SIZE = int(os.environ.get("CHAT_HISTORY_RING_SIZE", 100))
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 50))
+CHAT_HISTORY_FLUSH_MS = float(os.environ.get("CHAT_HISTORY_FLUSH_MS", 500))
+CHAT_HISTORY_SEGMENT_BYTES = int(os.environ.get("CHAT_HISTORY_SEGMENT_BYTES", 8 * 1024 * 1024))
+# Messages a client may send per second on average, and in a burst
+CHAT_RATE_PER_SECOND = float(os.environ.get("CHAT_RATE_PER_SECOND", 5))
+CHAT_RATE_BURST = int(os.environ.get("CHAT_RATE_BURST", 20))
+# Joins and leaves are batched and sent to room members once per tick
+CHAT_PRESENCE_TICK_MS = float(os.environ.get("CHAT_PRESENCE_TICK_MS", 100))
+# Each chat connection holds a file descriptor; 10k clients need a higher limit and accept backlog
+CHAT_OPEN_FILE_LIMIT = int(os.environ.get("CHAT_OPEN_FILE_LIMIT", 65536))
+CHAT_ACCEPT_BACKLOG = int(os.environ.get("CHAT_ACCEPT_BACKLOG", 4096))
+# permessage-deflate roughly doubles per-connection memory for little gain on short chat frames
+CHAT_WS_COMPRESSION = os.environ.get("CHAT_WS_COMPRESSION", "0") == "1"
+# With several uvicorn workers, rooms are shared through Redis (redis://host:port/db);
+# publishes are batched for this many milliseconds
+CHAT_REDIS_URL = os.environ.get("CHAT_REDIS_URL", "")
+CHAT_PUBLISH_BATCH_MS = float(os.environ.get("CHAT_PUBLISH_BATCH_MS", 5))
+
+# Routing decisions and fallbacks are logged as JSON lines (see model_router)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Learning Platform API",
@@ -34,33 +150,246 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Initialize metrics
+metrics = Registry()
+REQUEST_LATENCY = metrics.histogram(
+    "http_request_duration_seconds",
+    "Request latency per endpoint (time to response headers for streamed responses)",
+    ["endpoint", "method", "status"]
+)
+REQUESTS_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "Requests currently being handled")
+STAGE_LATENCY = metrics.histogram(
+    "pipeline_stage_duration_seconds",
+    "Latency of pipeline stages (transcript, metadata, llm, render)",
+    ["stage"]
+)
+LLM_LATENCY = metrics.histogram("llm_request_duration_seconds", "Gemini call latency per task type", ["task"])
+LLM_PROMPT_TOKENS = metrics.counter("llm_prompt_tokens_total", "Gemini prompt tokens per task type", ["task"])
+LLM_COMPLETION_TOKENS = metrics.counter("llm_completion_tokens_total", "Gemini completion tokens per task type", ["task"])
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record latency and in-flight count for every request"""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    
+    started = time.perf_counter()
+    status = 500
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=route.path if route else "unmatched",
+            method=request.method,
+            status=status
+        )
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    """Gemini errors that escaped a helper's wrapper still become a 503 with Retry-After"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Language model unavailable: {str(exc)}"},
+        headers={"Retry-After": str(int(exc.retry_after + 0.999))}
+    )
+
 # Initialize Gemini model
-model = genai.GenerativeModel(
-    model_name="gemini-1.5-pro",
-    generation_config={
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-    }
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+# Every Gemini call goes through its tier's governor, which adapts concurrency
+# to quota errors and timeouts, retries with backoff and fails fast during outages.
+# Quotas are per model, so each tier gets its own.
+llm_governors = {
+    tier: LLMGovernor(
+        max_limit=LLM_MAX_CONCURRENCY,
+        deadline=LLM_DEADLINE_SECONDS,
+        failure_threshold=LLM_CIRCUIT_FAILURES,
+        open_seconds=LLM_CIRCUIT_OPEN_SECONDS
+    )
+    for tier in ("flash", "pro")
+}
+model_router = ModelRouter(
+    {
+        "flash": GovernedModel(
+            genai.GenerativeModel(model_name=LLM_FAST_MODEL, generation_config=GENERATION_CONFIG),
+            llm_governors["flash"]
+        ),
+        "pro": GovernedModel(
+            genai.GenerativeModel(model_name=LLM_LARGE_MODEL, generation_config=GENERATION_CONFIG),
+            llm_governors["pro"]
+        ),
+    },
+    large_tasks=ROUTER_LARGE_TASKS,
+    small_input_tokens=ROUTER_SMALL_INPUT_TOKENS,
+    probe_seconds=ROUTER_PROBE_SECONDS
+)
+
+# Used for quiz, learning path and recommendation calls that must return JSON
+JSON_GENERATION_CONFIG = {
+    **GENERATION_CONFIG,
+    "response_mime_type": "application/json",
+}
+
+# Gemini calls are blocking, so endpoints run them on bounded thread pools,
+# one per tier so a throttled tier's queued calls never hold the other's threads
+llm_executor = TieredLLMExecutor(
+    {tier: LLMExecutor(max_concurrency=LLM_MAX_CONCURRENCY) for tier in ("flash", "pro")},
+    model_router.predict
 )
 
+def record_llm_usage(task_type, prompt, text, response, seconds):
+    """Record Gemini latency and token usage, estimating tokens when usage metadata is missing"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt)
+    completion_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(text)
+    
+    STAGE_LATENCY.observe(seconds, stage="llm")
+    LLM_LATENCY.observe(seconds, task=task_type)
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, task=task_type)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens, task=task_type)
+
+# Initialize Gemini response cache
+llm_cache = LLMCache(os.path.join(CACHE_DIR, "llm_cache.db"), on_generate=record_llm_usage)
+
+# Validates JSON responses, repairing them locally or re-asking only for broken fragments
+structured_output = StructuredOutput(llm_cache)
+
+# Hierarchical summarizer used for long transcripts
+summarizer = MapReduceSummarizer(
+    lambda template_id, prompt: model_router.route(template_id, prompt, GENERATION_CONFIG),
+    llm_cache, llm_executor,
+    chunk_tokens=SUMMARY_CHUNK_TOKENS,
+    max_concurrency=SUMMARY_MAP_CONCURRENCY
+)
+
+# Coalesces identical concurrent requests (e.g. a whole class opening the same video)
+singleflight = SingleFlight()
+
+# Headers for Server-Sent Event responses; disables proxy buffering
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+# Initialize transcript cache
+transcript_store = TranscriptStore(
+    os.path.join(CACHE_DIR, "transcripts.db"),
+    ttl_seconds=TRANSCRIPT_CACHE_TTL,
+    max_bytes=TRANSCRIPT_CACHE_MAX_BYTES
+)
+
+# Initialize per-video passage indexes used for question answering
+transcript_indexes = TranscriptIndexStore(os.path.join(CACHE_DIR, "indexes"))
+
+# Initialize per-video positional indexes used for in-transcript search
+search_indexes = TranscriptIndexStore(os.path.join(CACHE_DIR, "search_indexes"), index_cls=PhraseIndex)
+
 # ===== PYDANTIC MODELS =====
 
 class VideoRequest(BaseModel):
     url: str = Field(..., description="YouTube video URL")
+    bypass_cache: bool = Field(False, description="Regenerate instead of serving cached responses")
+    summary_mode: str = Field("auto", description="Summarization mode (auto, single or map_reduce)")
+
+class BatchVideoRequest(BaseModel):
+    urls: List[str] = Field(..., min_length=1, max_length=500, description="YouTube video URLs")
+    summary_mode: str = Field("auto", description="Summarization mode (auto, single or map_reduce)")
+    include_quiz: bool = Field(False, description="Also pre-generate a quiz for each video")
 
 class QuestionRequest(BaseModel):
     video_id: str = Field(..., description="YouTube video ID")
     question: str = Field(..., description="Question about the video content")
+    top_k: int = Field(5, ge=1, le=20, description="Number of transcript passages to answer from")
+    bypass_cache: bool = Field(False, description="Regenerate instead of serving cached responses")
 
 class LearningPathRequest(BaseModel):
     topic: str = Field(..., description="Learning topic")
     objective: str = Field(..., description="Learning objective")
     viz_type: str = Field("digraph", description="Visualization type (digraph or flowchart)")
+    image_format: str = Field("png", description="Visualization image format (png or svg)")
+    bypass_cache: bool = Field(False, description="Regenerate instead of serving cached responses")
 
 class ResourceRequest(BaseModel):
     topic: str = Field(..., description="Topic to find resources for")
+    bypass_cache: bool = Field(False, description="Regenerate instead of serving cached responses")
+
+# ----- Model output schemas -----
+
+class QuizQuestion(BaseModel):
+    type: str = Field(..., description="multiple_choice or true_false")
+    difficulty: str = Field("medium", description="easy, medium or hard")
+    question: str
+    options: List[str] = Field(..., min_length=2)
+    correct_answer: int = Field(..., ge=0)
+    explanation: str = ""
+    source: Optional[str] = None
+
+    @field_validator("correct_answer")
+    @classmethod
+    def answer_in_options(cls, value, info):
+        options = info.data.get("options")
+        if options is not None and value >= len(options):
+            raise ValueError("correct_answer must index into options")
+        return value
+
+class FlowNode(BaseModel):
+    id: str
+    label: str
+    description: str = ""
+    duration: str = ""
+    resources: List[Any] = []
+
+    @field_validator("id", mode="before")
+    @classmethod
+    def id_as_string(cls, value):
+        return str(value) if isinstance(value, int) else value
+
+class FlowEdge(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    source: str = Field(..., alias="from")
+    target: str = Field(..., alias="to")
+
+    @field_validator("source", "target", mode="before")
+    @classmethod
+    def id_as_string(cls, value):
+        return str(value) if isinstance(value, int) else value
+
+class LearningPathFlow(BaseModel):
+    nodes: List[FlowNode] = Field(..., min_length=1)
+    edges: List[FlowEdge] = []
+
+class CourseLink(BaseModel):
+    title: str
+    link: str
+    description: str = ""
+
+class BookLink(BaseModel):
+    title: str
+    author: str = ""
+    link: str
+    description: str = ""
+
+class TutorialLink(BaseModel):
+    title: str
+    link: str
+    channel: str = ""
+
+class Recommendations(BaseModel):
+    coursera_courses: List[CourseLink] = []
+    udemy_courses: List[CourseLink] = []
+    books: List[BookLink] = []
+    youtube_tutorials: List[TutorialLink] = []
 
 # ===== HELPER FUNCTIONS =====
 
@@ -79,45 +408,55 @@ def extract_video_id(url):
     
     return None
 
+def require_video_id(video_id):
+    """Reject anything that is not a bare YouTube video ID before it reaches a cache path"""
+    if not VIDEO_ID_PATTERN.fullmatch(video_id):
+        raise HTTPException(status_code=400, detail="Invalid YouTube video ID")
+
 def get_transcript(video_id):
-    """Get transcript for a YouTube video"""
+    """Get transcript for a YouTube video as a Transcript, served from the transcript cache when possible"""
     try:
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        return transcript_list
+        with STAGE_LATENCY.time(stage="transcript"):
+            transcript_list = transcript_store.get(video_id, YouTubeTranscriptApi.get_transcript)
+            return Transcript.from_segments(transcript_list)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Could not get transcript: {str(e)}")
 
 def get_video_info(video_id):
     """Get video information using pytube"""
     try:
-        yt = YouTube(f"https://www.youtube.com/watch?v={video_id}")
-        return {
-            "title": yt.title,
-            "author": yt.author,
-            "length": yt.length,
-            "thumbnail_url": yt.thumbnail_url
-        }
+        with STAGE_LATENCY.time(stage="metadata"):
+            yt = YouTube(f"https://www.youtube.com/watch?v={video_id}")
+            return {
+                "title": yt.title,
+                "author": yt.author,
+                "length": yt.length,
+                "thumbnail_url": yt.thumbnail_url
+            }
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Could not get video info: {str(e)}")
 
-def generate_summary(text):
-    """Generate summary using Gemini"""
-    try:
-        summary_prompt = f"""Summarize the following content in a concise way:
+def llm_http_error(e, message):
+    """HTTPException for a failed Gemini call: 503 with Retry-After while Gemini is unavailable, else 500"""
+    if isinstance(e, LLMUnavailableError):
+        return HTTPException(
+            status_code=503,
+            detail=f"{message}: {str(e)}",
+            headers={"Retry-After": str(int(e.retry_after + 0.999))}
+        )
+    return HTTPException(status_code=500, detail=f"{message}: {str(e)}")
+
+def build_summary_prompt(text):
+    """Prompt for a video summary"""
+    return f"""Summarize the following content in a concise way:
         {text}
         
         Provide a clear, structured summary that captures the main points and key insights.
         """
-        
-        response = model.generate_content(summary_prompt)
-        return response.text
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
 
-def generate_notes(text):
-    """Generate study notes using Gemini"""
-    try:
-        notes_prompt = f"""Create detailed study notes from the following content:
+def build_notes_prompt(text):
+    """Prompt for study notes"""
+    return f"""Create detailed study notes from the following content:
         {text}
         
         Format the notes with:
@@ -126,38 +465,102 @@ def generate_notes(text):
         - Important definitions
         - Bullet points for clarity
         """
-        
-        response = model.generate_content(notes_prompt)
-        return response.text
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating notes: {str(e)}")
 
-def get_qa_response(question, context):
-    """Get answer to user question using Gemini"""
-    try:
-        qa_prompt = f"""Answer the following question based on this content:
+def build_qa_prompt(question, context):
+    """Prompt for answering a question from timestamped transcript excerpts"""
+    return f"""Answer the following question based on these timestamped excerpts from a video transcript:
         
         Content: {context}
         
         Question: {question}
         
         Provide a detailed, accurate answer using only information from the content.
+        Cite the timestamps of the excerpts you used, e.g. [00:12:30].
         """
-        
-        response = model.generate_content(qa_prompt)
-        return response.text
+
+def generate_summary(text, bypass_cache=False):
+    """Generate summary using Gemini"""
+    try:
+        prompt = build_summary_prompt(text)
+        model, generation_config = model_router.route("summary", prompt, GENERATION_CONFIG)
+        return llm_cache.generate(
+            model, prompt, "summary", text,
+            task_type="summary", generation_config=generation_config, bypass=bypass_cache
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
+        raise llm_http_error(e, "Error generating summary")
 
-def generate_quiz(text):
-    """Generate quiz questions using Gemini"""
+def generate_notes(text, bypass_cache=False):
+    """Generate study notes using Gemini"""
     try:
+        prompt = build_notes_prompt(text)
+        model, generation_config = model_router.route("notes", prompt, GENERATION_CONFIG)
+        return llm_cache.generate(
+            model, prompt, "notes", text,
+            task_type="notes", generation_config=generation_config, bypass=bypass_cache
+        )
+    except Exception as e:
+        raise llm_http_error(e, "Error generating notes")
+
+def use_map_reduce(text, summary_mode):
+    """Whether to summarize `text` hierarchically"""
+    if summary_mode == "auto":
+        return estimate_tokens(text) > LONG_TRANSCRIPT_TOKENS
+    return summary_mode == "map_reduce"
+
+async def summarize_text(text, summary_mode="auto", bypass_cache=False, executor=None):
+    """Summarize in one call, or with map-reduce for long transcripts"""
+    executor = executor or llm_executor
+    if not use_map_reduce(text, summary_mode):
+        return await executor.tier("summary", text).run(generate_summary, text, bypass_cache)
+    try:
+        return await summarizer.summarize(text, bypass_cache, executor)
+    except Exception as e:
+        raise llm_http_error(e, "Error generating summary")
+
+def format_passages(passages):
+    """Render retrieved passages as timestamped context for the model"""
+    return "\n\n".join(
+        f"[{format_timestamp(p['start'])} - {format_timestamp(p['end'])}] {p['text']}"
+        for p in passages
+    )
+
+def get_qa_response(question, context, bypass_cache=False):
+    """Get answer to user question using Gemini"""
+    try:
+        prompt = build_qa_prompt(question, context)
+        model, generation_config = model_router.route("qa", prompt, GENERATION_CONFIG)
+        return llm_cache.generate(
+            model, prompt, "qa", [question, context],
+            task_type="qa", generation_config=generation_config, bypass=bypass_cache
+        )
+    except Exception as e:
+        raise llm_http_error(e, "Error answering question")
+
+def generate_quiz(text, bypass_cache=False, count=5, avoid=None, difficulty=None, question_type=None):
+    """Generate quiz questions using Gemini, skipping the questions in `avoid`"""
+    try:
+        avoid = avoid or []
+        mix = "Mix of multiple choice and true/false questions, and of easy, medium and hard difficulty"
+        if difficulty or question_type:
+            mix = "Every question must be " + " and ".join(
+                part for part in (
+                    f'of "{difficulty}" difficulty' if difficulty else None,
+                    f'of type "{question_type}"' if question_type else None
+                ) if part
+            )
+        avoid_text = ""
+        if avoid:
+            avoid_text = "Do not repeat or rephrase any of these existing questions:\n        " + "\n        ".join(
+                f"- {question}" for question in avoid
+            )
+        
         quiz_prompt = f"""Create a quiz based on this content. Format your response as a valid JSON array of questions.
         Content: {text}
 
         Requirements:
-        1. Generate exactly 5 questions
-        2. Mix of multiple choice and true/false questions
+        1. Generate exactly {count} questions
+        2. {mix}
         3. Each question must follow this exact JSON format:
         {{
             "type": "multiple_choice",
@@ -169,21 +572,60 @@ def generate_quiz(text):
             "source": "Content"
         }}
         
+        {avoid_text}
         Ensure the response is ONLY the JSON array with no additional text.
         """
         
-        response = model.generate_content(quiz_prompt)
-        quiz_text = response.text.strip()
-        
-        # Clean the response to ensure valid JSON
-        if "```json" in quiz_text:
-            quiz_text = quiz_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in quiz_text:
-            quiz_text = quiz_text.split("```")[1].strip()
-        
-        return json.loads(quiz_text)
+        return model_router.run(
+            "quiz", quiz_prompt,
+            lambda model, generation_config: structured_output.generate(
+                model, quiz_prompt, "quiz", [text, count, avoid, difficulty, question_type], List[QuizQuestion],
+                task_type="quiz", generation_config=generation_config, bypass=bypass_cache
+            ),
+            JSON_GENERATION_CONFIG
+        )
+    except Exception as e:
+        raise llm_http_error(e, "Error generating quiz")
+
+async def timed_stage(timings, name, awaitable):
+    """Await a pipeline stage and record its wall-clock duration in seconds"""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = round(time.perf_counter() - started, 3)
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def relay_llm_stream(queue, name, chunks, parts):
+    """Forward streamed LLM text to an SSE queue as `name` delta events"""
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            await queue.put(sse_event(name, {"delta": chunk}))
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating quiz: {str(e)}")
+        raise llm_http_error(e, f"Error generating {name}")
+    return "".join(parts)
+
+async def merge_sse_tasks(queue, tasks):
+    """Yield events from `queue` until every producer task has finished"""
+    pending = len(tasks)
+    for task in tasks:
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while pending:
+            event = await queue.get()
+            if event is None:
+                pending -= 1
+                continue
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
 
 def check_graphviz():
     """Check if Graphviz is installed and accessible"""
@@ -196,9 +638,9 @@ def check_graphviz():
             if os.path.exists(path):
                 os.environ["PATH"] += os.pathsep + path
                 return True
-    return False
+    return shutil.which("dot") is not None
 
-def get_flow_from_gemini(topic, objective):
+def get_flow_from_gemini(topic, objective, bypass_cache=False):
     """Get flow structure from Gemini API"""
     try:
         prompt = f"""As an expert AI agent specializing in creating detailed learning paths and roadmaps, please create a comprehensive flow for:
@@ -239,20 +681,18 @@ def get_flow_from_gemini(topic, objective):
 
         Make the flow practical, actionable, and comprehensive."""
 
-        response = model.generate_content(prompt)
-        json_str = response.text.strip()
-        
-        # Clean the response to ensure valid JSON
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0].strip()
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].strip()
-            
-        return json.loads(json_str)
+        return model_router.run(
+            "learning_path", prompt,
+            lambda model, generation_config: structured_output.generate(
+                model, prompt, "learning_path", [topic, objective], LearningPathFlow,
+                task_type="learning_path", generation_config=generation_config, bypass=bypass_cache
+            ),
+            JSON_GENERATION_CONFIG
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating learning path: {str(e)}")
+        raise llm_http_error(e, "Error generating learning path")
 
-def get_recommendations_from_gemini(topic):
+def get_recommendations_from_gemini(topic, bypass_cache=False):
     """Get course and book recommendations using Gemini API"""
     try:
         prompt = f"""As an expert in {topic}, provide a curated list of the best learning resources.
@@ -298,18 +738,16 @@ def get_recommendations_from_gemini(topic):
         
         Ensure all links are real and active. Include only highly-rated and current resources."""
 
-        response = model.generate_content(prompt)
-        json_str = response.text.strip()
-        
-        # Clean the response to ensure valid JSON
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0].strip()
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].strip()
-            
-        return json.loads(json_str)
+        return model_router.run(
+            "recommendations", prompt,
+            lambda model, generation_config: structured_output.generate(
+                model, prompt, "recommendations", topic, Recommendations,
+                task_type="recommendations", generation_config=generation_config, bypass=bypass_cache
+            ),
+            JSON_GENERATION_CONFIG
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting recommendations: {str(e)}")
+        raise llm_http_error(e, "Error getting recommendations")
 
 # ===== API ENDPOINTS =====
 
@@ -321,34 +759,182 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "video": "/video",
+            "video-stream": "/video/stream",
+            "video-batch": "/video/batch",
+            "video-transcript": "/video/{video_id}/transcript",
+            "video-search": "/video/{video_id}/search?q=",
             "question": "/question",
+            "question-stream": "/question/stream",
             "quiz": "/quiz",
             "learning-path": "/learning-path",
-            "resources": "/resources"
+            "jobs": "/jobs/{job_id}",
+            "renders": "/renders/{filename}",
+            "resources": "/resources",
+            "chat": "ws://{host}/ws/chat/",
+            "chat-stats": "/chat/stats",
+            "chat-audio": "/chat/audio/{digest}",
+            "cache-stats": "/cache/stats",
+            "llm-stats": "/llm/stats",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Cache hit/miss counters"""
+    return {
+        "transcripts": transcript_store.stats(),
+        "llm_responses": llm_cache.stats(),
+        "coalescing": singleflight.stats(),
+        "quiz_bank": quiz_bank.stats(),
+        "renders": graph_renderer.stats(),
+        "resources": resource_cache.stats()
+    }
+
+def collect_runtime_metrics():
+    """Cache, executor and coalescing metrics read from their stats at scrape time"""
+    caches = {
+        "transcripts": transcript_store.stats(),
+        "llm_responses": llm_cache.stats()
+    }
+    llm = llm_executor.stats()
+    coalescing = singleflight.stats()["by_namespace"]
+    coalesced = [({"namespace": name}, stats["deduplicated"]) for name, stats in coalescing.items()]
+    coalesced.append(({"namespace": "quiz_bank"}, quiz_bank.deduplicated))
+    repairs = structured_output.stats()
+    governors = {tier: governor.stats() for tier, governor in llm_governors.items()}
+    routing = model_router.stats()
+    chat = chat_hub.stats()
+    
+    return [
+        ("cache_hits_total", "Cache hits", "counter",
+         [({"cache": "transcripts"}, caches["transcripts"]["hits"]),
+          ({"cache": "llm_responses"}, caches["llm_responses"]["memory_hits"] + caches["llm_responses"]["disk_hits"])]),
+        ("cache_misses_total", "Cache misses", "counter",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("cache_hit_ratio", "Cache hit ratio since start", "gauge",
+         [({"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()]),
+        ("llm_cache_hit_ratio", "LLM response cache hit ratio per task type", "gauge",
+         [({"task": task}, stats["hit_ratio"]) for task, stats in caches["llm_responses"]["by_task"].items()]),
+        ("llm_in_flight", "Gemini calls currently running", "gauge", [({}, llm["in_flight"])]),
+        ("llm_queue_depth", "Gemini calls waiting for a concurrency slot", "gauge", [({}, llm["queue_depth"])]),
+        ("coalesced_requests_total", "Requests served by another request's computation", "counter",
+         coalesced),
+        ("llm_concurrency_limit", "Current adaptive Gemini concurrency limit", "gauge",
+         [({"tier": tier}, stats["limit"]) for tier, stats in governors.items()]),
+        ("llm_circuit_open", "1 while the Gemini circuit breaker is open", "gauge",
+         [({"tier": tier}, 1 if stats["state"] == "open" else 0) for tier, stats in governors.items()]),
+        ("llm_retries_total", "Gemini calls retried after a retryable error", "counter",
+         [({"tier": tier}, stats["retries"]) for tier, stats in governors.items()]),
+        ("llm_throttled_total", "Gemini calls rejected with 429", "counter",
+         [({"tier": tier}, stats["throttled"]) for tier, stats in governors.items()]),
+        ("llm_rejected_total", "Gemini calls failed fast by the circuit breaker or deadline", "counter",
+         [({"tier": tier}, stats["rejected"]) for tier, stats in governors.items()]),
+        ("llm_route_fallbacks_total", "Calls retried on a larger model after failed validation", "counter",
+         [({}, routing["fallbacks"])]),
+        ("structured_output_total", "JSON responses by how they were made valid", "counter",
+         [({"outcome": outcome}, count) for outcome, count in repairs.items()]),
+        ("chat_connections", "Open study room chat connections", "gauge", [({}, chat["connections"])]),
+        ("chat_rooms", "Study rooms", "gauge", [({}, chat["rooms"])]),
+        ("chat_messages_total", "Chat and audio messages relayed", "counter", [({}, chat["messages"])]),
+        ("chat_deliveries_total", "Frames queued to chat clients by room fan-out", "counter",
+         [({}, chat["deliveries"])]),
+        ("chat_slow_disconnects_total", "Chat clients disconnected for not keeping up", "counter",
+         [({}, chat["slow_disconnects"])]),
+    ]
+
+metrics.register_collector(collect_runtime_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Gemini concurrency, queue-depth, flow-control and structured-output repair metrics"""
+    return {
+        **llm_executor.stats(),
+        "governors": {tier: governor.stats() for tier, governor in llm_governors.items()},
+        "routing": model_router.stats(),
+        "structured_output": structured_output.stats()
+    }
+
 # ----- VIDEO PROCESSING ENDPOINTS -----
 
-@app.post("/video")
-async def process_video(request: VideoRequest):
-    """Process a YouTube video and return summary, notes, and transcript"""
-    video_id = extract_video_id(request.url)
+# Stage limits shared by all batch items
+batch_transcript_slots = asyncio.Semaphore(BATCH_TRANSCRIPT_CONCURRENCY)
+batch_llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+# Holds a batch slot per LLM call, including each map-reduce chunk call
+batch_llm_executor = llm_executor.limited(batch_llm_slots)
+
+async def process_batch_item(item):
+    """Run the /video pipeline for one batch item and warm the /question and /quiz caches"""
+    video_id = extract_video_id(item["url"])
     if not video_id:
         raise HTTPException(status_code=400, detail="Invalid YouTube URL")
     
-    # Get video info
-    video_info = get_video_info(video_id)
+    result = await run_video_pipeline(
+        video_id, item["summary_mode"],
+        transcript_slots=batch_transcript_slots, executor=batch_llm_executor
+    )
+    await asyncio.to_thread(transcript_indexes.get, video_id, get_transcript)
+    if item["include_quiz"]:
+        await bounded(batch_llm_slots, quiz_bank.ensure(video_id))
     
-    # Get transcript
-    transcript = get_transcript(video_id)
+    # The transcript stays in the transcript cache; keep batch results small
+    return {
+        "video_id": video_id,
+        "video_info": result["video_info"],
+        "summary": result["summary"],
+        "notes": result["notes"],
+        "timings": result["timings"]
+    }
+
+batch_queue = BatchQueue(
+    process_batch_item,
+    workers=BATCH_WORKERS,
+    retention_seconds=BATCH_RETENTION_SECONDS
+)
+
+async def bounded(slots, awaitable):
+    """Await `awaitable` while holding one of `slots`, if a semaphore is given"""
+    if slots is None:
+        return await awaitable
+    async with slots:
+        return await awaitable
+
+async def run_video_pipeline(video_id, summary_mode="auto", bypass_cache=False,
+                             transcript_slots=None, executor=None):
+    """Fetch metadata and transcript, then generate summary and notes"""
+    executor = executor or llm_executor
+    timings = {}
+    started = time.perf_counter()
+    
+    # Metadata and transcript are independent, so fetch them concurrently
+    info_task = asyncio.create_task(
+        timed_stage(timings, "video_info", bounded(transcript_slots, asyncio.to_thread(get_video_info, video_id)))
+    )
+    try:
+        transcript = await timed_stage(
+            timings, "transcript", bounded(transcript_slots, asyncio.to_thread(get_transcript, video_id))
+        )
+    except Exception:
+        info_task.cancel()
+        raise
     
-    # Combine transcript text
-    full_text = " ".join([item["text"] for item in transcript])
+    full_text = transcript.full_text
     
-    # Generate summary and notes
-    summary = generate_summary(full_text)
-    notes = generate_notes(full_text)
+    # Summary and notes only depend on the transcript, so they start without
+    # waiting for metadata and run in parallel
+    video_info, summary, notes = await asyncio.gather(
+        info_task,
+        timed_stage(timings, "summary", summarize_text(full_text, summary_mode, bypass_cache, executor)),
+        timed_stage(
+            timings, "notes", executor.tier("notes", full_text).run(generate_notes, full_text, bypass_cache)
+        )
+    )
+    timings["total"] = round(time.perf_counter() - started, 3)
     
     return {
         "video_id": video_id,
@@ -356,105 +942,564 @@ async def process_video(request: VideoRequest):
         "summary": summary,
         "notes": notes,
         "transcript": transcript,
-        "full_text": full_text
+        "full_text": full_text,
+        "timings": timings
+    }
+
+async def coalesced_video_pipeline(video_id, summary_mode="auto", bypass_cache=False):
+    """run_video_pipeline, shared between concurrent requests for the same video"""
+    key = f"video:{video_id}:{summary_mode}:{int(bypass_cache)}"
+    return await singleflight.do(key, lambda: run_video_pipeline(video_id, summary_mode, bypass_cache))
+
+async def video_job(video_id, summary_mode="auto", bypass_cache=False):
+    """Video pipeline as a background job; job results must be JSON-serialisable"""
+    result = await coalesced_video_pipeline(video_id, summary_mode, bypass_cache)
+    return {**result, "transcript": result["transcript"].to_segments()}
+
+@app.post("/video")
+async def process_video(
+    request: VideoRequest,
+    raw_request: Request,
+    mode: str = Query("sync", description="sync, or async to run as a background job"),
+    fields: Optional[str] = Query(None, description="Comma-separated response fields to include, e.g. summary,notes"),
+    transcript_start: Optional[float] = Query(None, ge=0, description="Only include transcript from this second"),
+    transcript_end: Optional[float] = Query(None, ge=0, description="Only include transcript before this second"),
+    transcript_format: str = Query("rows", description="rows (list of segments) or columnar (parallel arrays)")
+):
+    """Process a YouTube video and return summary, notes, and transcript"""
+    video_id = extract_video_id(request.url)
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    if mode == "async":
+        return submit_job("video", {
+            "video_id": video_id,
+            "summary_mode": request.summary_mode,
+            "bypass_cache": request.bypass_cache
+        })
+    
+    result = await coalesced_video_pipeline(video_id, request.summary_mode, request.bypass_cache)
+    
+    # Shape a copy; coalesced callers share the same result object
+    payload = select_fields(result, fields)
+    segments = result["transcript"].slice(transcript_start, transcript_end)
+    if "transcript" in payload:
+        payload = {
+            **payload,
+            "transcript": segments.to_columnar() if transcript_format == "columnar" else segments.to_segments()
+        }
+    if "full_text" in payload and (transcript_start is not None or transcript_end is not None):
+        # The range applies to full_text whether or not the segments are included
+        payload = {**payload, "full_text": segments.full_text}
+    
+    return json_response(raw_request, payload)
+
+@app.get("/video/{video_id}/transcript")
+async def get_video_transcript(
+    video_id: str,
+    raw_request: Request,
+    start: Optional[float] = Query(None, ge=0, description="Start of the time range in seconds"),
+    end: Optional[float] = Query(None, ge=0, description="End of the time range in seconds"),
+    transcript_format: str = Query("columnar", description="rows (list of segments) or columnar (parallel arrays)")
+):
+    """Page through a cached transcript by time range"""
+    transcript = await asyncio.to_thread(get_transcript, video_id)
+    segments = transcript.slice(start, end)
+    
+    return json_response(raw_request, {
+        "video_id": video_id,
+        "start": start,
+        "end": end,
+        "segments": len(segments),
+        "transcript": segments.to_columnar() if transcript_format == "columnar" else segments.to_segments()
+    })
+
+@app.get("/video/{video_id}/search")
+async def search_video(
+    video_id: str,
+    q: str = Query(..., min_length=1, description='Keywords and/or "quoted phrases"'),
+    limit: int = Query(10, ge=1, le=100, description="Maximum number of segments to return")
+):
+    """Find the segments of a video matching phrases and keywords, without calling the LLM"""
+    require_video_id(video_id)
+    index = await asyncio.to_thread(search_indexes.get, video_id, get_transcript)
+    
+    started = time.perf_counter()
+    results = index.search(q, limit)
+    
+    return {
+        "video_id": video_id,
+        "query": q,
+        "total_matches": index.count_matches(q),
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+@app.post("/video/batch", status_code=202)
+async def submit_video_batch(request: BatchVideoRequest):
+    """Queue many videos for background processing and return a batch id to poll"""
+    batch_id = batch_queue.submit([
+        {"url": url, "summary_mode": request.summary_mode, "include_quiz": request.include_quiz}
+        for url in request.urls
+    ])
+    
+    return {
+        "batch_id": batch_id,
+        "items": len(request.urls),
+        "status_url": f"/video/batch/{batch_id}"
     }
 
+@app.get("/video/batch/{batch_id}")
+async def get_video_batch(batch_id: str):
+    """Per-item status and results of a video batch"""
+    status = batch_queue.status(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown batch id")
+    return status
+
+@app.post("/video/stream")
+async def process_video_stream(request: VideoRequest):
+    """Process a YouTube video, streaming summary and notes as Server-Sent Events
+    
+    Events: `video_info`, `summary` and `notes` deltas as they are generated,
+    then `done` with the same payload as /video (or `error`).
+    """
+    video_id = extract_video_id(request.url)
+    if not video_id:
+        raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+    
+    # Fetch the transcript up front so a missing transcript is still a 404
+    timings = {}
+    started = time.perf_counter()
+    transcript = await timed_stage(timings, "transcript", asyncio.to_thread(get_transcript, video_id))
+    full_text = transcript.full_text
+    
+    async def events():
+        queue = asyncio.Queue()
+        
+        async def fetch_video_info():
+            video_info = await timed_stage(timings, "video_info", asyncio.to_thread(get_video_info, video_id))
+            await queue.put(sse_event("video_info", video_info))
+            return video_info
+        
+        def generation(name, template_id, prompt, content):
+            model, generation_config = model_router.route(template_id, prompt, GENERATION_CONFIG)
+            chunks = llm_executor.tier(template_id, prompt).stream(
+                llm_cache.stream, model, prompt, template_id, content,
+                task_type=name, generation_config=generation_config, bypass=request.bypass_cache
+            )
+            return relay_llm_stream(queue, name, chunks, [])
+        
+        async def stream_summary():
+            if not use_map_reduce(full_text, request.summary_mode):
+                return await generation("summary", "summary", build_summary_prompt(full_text), full_text)
+            
+            # Chunk summaries cannot be streamed usefully, so only the final
+            # reduce step is streamed
+            try:
+                partials = await summarizer.map(full_text, request.bypass_cache)
+            except Exception as e:
+                raise llm_http_error(e, "Error generating summary")
+            if len(partials) == 1:
+                await queue.put(sse_event("summary", {"delta": partials[0]}))
+                return partials[0]
+            return await generation("summary", "summary_reduce", build_reduce_prompt(partials), partials)
+        
+        tasks = [
+            asyncio.create_task(fetch_video_info()),
+            asyncio.create_task(timed_stage(timings, "summary", stream_summary())),
+            asyncio.create_task(timed_stage(
+                timings, "notes", generation("notes", "notes", build_notes_prompt(full_text), full_text)
+            ))
+        ]
+        try:
+            async for event in merge_sse_tasks(queue, tasks):
+                yield event
+            video_info, summary, notes = [task.result() for task in tasks]
+            timings["total"] = round(time.perf_counter() - started, 3)
+            yield sse_event("done", {
+                "video_id": video_id,
+                "video_info": video_info,
+                "summary": summary,
+                "notes": notes,
+                "transcript": transcript.to_segments(),
+                "full_text": full_text,
+                "timings": timings
+            })
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def retrieve_passages(video_id, question, top_k):
+    """Top-k transcript passages for a question"""
+    require_video_id(video_id)
+    index = await asyncio.to_thread(transcript_indexes.get, video_id, get_transcript)
+    passages = index.search(question, k=top_k)
+    if not passages:
+        raise HTTPException(status_code=404, detail="Transcript is empty")
+    return passages
+
+def format_sources(passages):
+    """Passages as returned to clients, with a display timestamp"""
+    return [
+        {
+            "start": p["start"],
+            "end": p["end"],
+            "timestamp": format_timestamp(p["start"]),
+            "text": p["text"],
+            "score": p["score"]
+        }
+        for p in passages
+    ]
+
 @app.post("/question")
 async def answer_question(request: QuestionRequest):
-    """Answer a question about a video's content"""
-    # Get transcript
-    transcript = get_transcript(request.video_id)
-    
-    # Combine transcript text
-    full_text = " ".join([item["text"] for item in transcript])
+    """Answer a question about a video's content from its most relevant passages"""
+    # Retrieve the passages most relevant to the question
+    passages = await retrieve_passages(request.video_id, request.question, request.top_k)
     
     # Get answer
-    answer = get_qa_response(request.question, full_text)
+    context = format_passages(passages)
+    answer = await llm_executor.tier("qa", context).run(
+        get_qa_response, request.question, context, request.bypass_cache
+    )
     
     return {
         "question": request.question,
-        "answer": answer
+        "answer": answer,
+        "sources": format_sources(passages)
     }
 
-@app.get("/quiz/{video_id}")
-async def get_quiz(video_id: str):
-    """Generate a quiz for a video"""
+@app.post("/question/stream")
+async def answer_question_stream(request: QuestionRequest):
+    """Answer a question about a video, streaming the answer as Server-Sent Events
+    
+    Events: `sources` first, then `answer` deltas, then `done` with the same
+    payload as /question (or `error`).
+    """
+    passages = await retrieve_passages(request.video_id, request.question, request.top_k)
+    sources = format_sources(passages)
+    context = format_passages(passages)
+    
+    async def events():
+        yield sse_event("sources", sources)
+        queue = asyncio.Queue()
+        prompt = build_qa_prompt(request.question, context)
+        model, generation_config = model_router.route("qa", prompt, GENERATION_CONFIG)
+        chunks = llm_executor.tier("qa", prompt).stream(
+            llm_cache.stream, model, prompt, "qa", [request.question, context],
+            task_type="qa", generation_config=generation_config, bypass=request.bypass_cache
+        )
+        task = asyncio.create_task(relay_llm_stream(queue, "answer", chunks, []))
+        try:
+            async for event in merge_sse_tasks(queue, [task]):
+                yield event
+            yield sse_event("done", {
+                "question": request.question,
+                "answer": task.result(),
+                "sources": sources
+            })
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def fill_quiz_bank(video_id, existing, count, difficulty=None, question_type=None):
+    """Generate `count` new questions for a video's quiz bank, optionally of one difficulty or type"""
     # Get transcript
-    transcript = get_transcript(video_id)
+    transcript = await asyncio.to_thread(get_transcript, video_id)
     
-    # Combine transcript text
-    full_text = " ".join([item["text"] for item in transcript])
+    return await llm_executor.tier("quiz", transcript.full_text).run(
+        generate_quiz, transcript.full_text, False, count, [question["question"] for question in existing],
+        difficulty, question_type
+    )
+
+quiz_bank = QuizBank(
+    os.path.join(CACHE_DIR, "quiz_bank.db"),
+    fill_quiz_bank,
+    batch_size=QUIZ_BANK_BATCH_SIZE,
+    max_size=QUIZ_BANK_MAX_SIZE,
+    low_water=QUIZ_BANK_LOW_WATER
+)
+
+@app.get("/quiz/{video_id}")
+async def get_quiz(
+    video_id: str,
+    bypass_cache: bool = Query(False, description="Add freshly generated questions to the pool first"),
+    session_id: Optional[str] = Query(None, description="Avoid repeating questions already dealt to this session"),
+    difficulty: Optional[str] = Query(None, pattern="^(easy|medium|hard)$", description="Only easy, medium or hard questions"),
+    question_type: Optional[str] = Query(None, pattern="^(multiple_choice|true_false)$", description="Only multiple_choice or true_false questions"),
+    size: int = Query(5, ge=1, le=20, description="Number of questions")
+):
+    """Deal a random set of questions from the video's quiz bank"""
+    if bypass_cache and quiz_bank.size(video_id) < QUIZ_BANK_MAX_SIZE:
+        await quiz_bank.refill(video_id)
     
-    # Generate quiz
-    quiz = generate_quiz(full_text)
+    quiz = await quiz_bank.draw(
+        video_id, size, session=session_id, difficulty=difficulty, question_type=question_type
+    )
+    if not quiz:
+        raise HTTPException(status_code=404, detail="No quiz questions match the requested difficulty and type")
     
     return {
         "video_id": video_id,
-        "quiz": quiz
+        "quiz": quiz,
+        "pool_size": quiz_bank.size(video_id)
     }
 
 # ----- LEARNING PATH ENDPOINTS -----
 
-@app.post("/learning-path")
-async def create_learning_path(request: LearningPathRequest):
-    """Create a learning path for a topic and objective"""
+# Rendered images are content-addressed, so they can be cached forever
+graph_renderer = GraphRenderer(
+    os.path.join(CACHE_DIR, "renders"),
+    workers=RENDER_WORKERS,
+    timeout=RENDER_TIMEOUT_SECONDS
+)
+
+async def run_learning_path(topic, objective, viz_type="digraph", bypass_cache=False, image_format="png"):
+    """Generate the learning path flow and render its visualization"""
+    if image_format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of {', '.join(FORMATS)}")
+    
     # Check if Graphviz is installed
     graphviz_installed = check_graphviz()
     
     # Get learning path data
-    flow_data = get_flow_from_gemini(request.topic, request.objective)
+    flow_data = await llm_executor.tier("learning_path", topic).run(
+        get_flow_from_gemini, topic, objective, bypass_cache
+    )
     
     # Create visualization if Graphviz is installed
     visualization_url = None
     if graphviz_installed:
         try:
-            dot = graphviz.Digraph(
-                comment='Flow Visualization',
-                graph_attr={
-                    'rankdir': 'LR' if request.viz_type == "digraph" else 'TB',
-                    'splines': 'ortho',
-                    'nodesep': '0.8',
-                    'ranksep': '1.0',
-                    'fontname': 'Arial',
-                    'fontsize': '12'
-                }
-            )
-            
-            # Add nodes
-            for node in flow_data["nodes"]:
-                dot.node(node['id'], node['label'])
-            
-            # Add edges
-            for edge in flow_data["edges"]:
-                dot.edge(edge['from'], edge['to'])
-            
-            # Render visualization
-            dot.render("learning_path", format="png", cleanup=True)
-            visualization_url = "learning_path.png"
+            with STAGE_LATENCY.time(stage="render"):
+                filename = await graph_renderer.render(flow_data, viz_type, image_format)
+            visualization_url = f"/renders/{filename}"
         except Exception as e:
             visualization_url = None
     
     return {
-        "topic": request.topic,
-        "objective": request.objective,
+        "topic": topic,
+        "objective": objective,
         "flow_data": flow_data,
         "visualization_available": graphviz_installed,
         "visualization_url": visualization_url
     }
 
+async def coalesced_learning_path(topic, objective, viz_type="digraph", bypass_cache=False, image_format="png"):
+    """run_learning_path, shared between concurrent requests for the same topic and objective"""
+    key = (
+        f"learning_path:{normalize_text(topic)}|{normalize_text(objective)}|"
+        f"{viz_type}|{image_format}|{int(bypass_cache)}"
+    )
+    return await singleflight.do(
+        key, lambda: run_learning_path(topic, objective, viz_type, bypass_cache, image_format)
+    )
+
+@app.post("/learning-path")
+async def create_learning_path(request: LearningPathRequest, mode: str = Query("sync", description="sync, or async to run as a background job")):
+    """Create a learning path for a topic and objective"""
+    params = {
+        "topic": request.topic,
+        "objective": request.objective,
+        "viz_type": request.viz_type,
+        "image_format": request.image_format,
+        "bypass_cache": request.bypass_cache
+    }
+    if mode == "async":
+        return submit_job("learning_path", params)
+    
+    return await coalesced_learning_path(**params)
+
+@app.get("/renders/{filename}")
+async def get_render(filename: str):
+    """Serve a rendered learning path image; names are content hashes, so responses never change"""
+    if not re.fullmatch(r"[0-9a-f]{64}\.(png|svg)", filename):
+        raise HTTPException(status_code=404, detail="Render not found")
+    
+    path = graph_renderer.path(filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Render not found")
+    
+    return FileResponse(
+        path,
+        media_type="image/svg+xml" if filename.endswith(".svg") else "image/png",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+# ----- JOB ENDPOINTS -----
+
+job_runner = JobRunner(
+    JobStore(os.path.join(CACHE_DIR, "jobs.db"), retention_seconds=JOB_RETENTION_SECONDS),
+    {
+        "video": video_job,
+        "learning_path": coalesced_learning_path
+    },
+    workers=JOB_WORKERS,
+    heartbeat_seconds=JOB_HEARTBEAT_SECONDS
+)
+
+@app.on_event("startup")
+async def start_jobs():
+    """Claim jobs left behind by stopped workers and start heartbeating"""
+    job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    job_runner.stop()
+
+def submit_job(kind, params):
+    """Start a background job and return a 202 response pointing at it"""
+    job_id = job_runner.submit(kind, params)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+        headers={"Location": f"/jobs/{job_id}"}
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, description="Seconds to long-poll for completion")):
+    """Status and result of a background job"""
+    job = await job_runner.wait(job_id, min(wait, JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job id")
+    return job
+
 # ----- RESOURCE FINDER ENDPOINTS -----
 
+# Recommendations for similar topics ("python data science", "Data Science with Python") are shared
+resource_cache = SemanticCache(
+    os.path.join(CACHE_DIR, "resources.db"),
+    threshold=RESOURCE_SIMILARITY_THRESHOLD
+)
+
 @app.post("/resources")
 async def find_resources(request: ResourceRequest):
     """Find learning resources for a topic"""
-    # Get recommendations
-    resources = get_recommendations_from_gemini(request.topic)
+    if not request.bypass_cache:
+        cached = resource_cache.lookup(request.topic)
+        if cached is not None:
+            resources, matched_topic, similarity = cached
+            return {
+                "topic": request.topic,
+                "resources": resources,
+                "matched_topic": matched_topic,
+                "similarity": round(similarity, 3)
+            }
+    
+    async def build_resources():
+        # Get recommendations
+        resources = await llm_executor.tier("recommendations", request.topic).run(
+            get_recommendations_from_gemini, request.topic, request.bypass_cache
+        )
+        resource_cache.put(request.topic, resources)
+        return resources
+    
+    key = f"resources:{normalize_topic(request.topic)}|{int(request.bypass_cache)}"
+    resources = await singleflight.do(key, build_resources)
     
     return {
         "topic": request.topic,
         "resources": resources
     }
 
+# ----- CHAT ENDPOINTS -----
+
+# Audio clips are stored once under their SHA-256 and fetched by clients from /chat/audio
+chat_audio_store = BlobStore(os.path.join(CACHE_DIR, "chat_audio"), max_bytes=CHAT_AUDIO_STORE_MAX_BYTES)
+
+chat_history = ChatHistory(
+    os.path.join(CACHE_DIR, "chat_history"),
+    ring_size=CHAT_HISTORY_RING_SIZE,
+    segment_bytes=CHAT_HISTORY_SEGMENT_BYTES,
+    flush_interval=CHAT_HISTORY_FLUSH_MS / 1000
+)
+
+chat_hub = ChatHub(
+    bus=RedisPubSub(CHAT_REDIS_URL, flush_interval=CHAT_PUBLISH_BATCH_MS / 1000) if CHAT_REDIS_URL else InProcessPubSub(),
+    queue_size=CHAT_SEND_QUEUE_SIZE,
+    max_rooms=CHAT_MAX_ROOMS,
+    max_message_chars=CHAT_MAX_MESSAGE_CHARS,
+    max_audio_bytes=CHAT_MAX_AUDIO_BYTES,
+    rate_per_second=CHAT_RATE_PER_SECOND,
+    rate_burst=CHAT_RATE_BURST,
+    blob_store=chat_audio_store,
+    max_chunk_bytes=CHAT_MAX_FRAME_BYTES,
+    upload_timeout=CHAT_AUDIO_UPLOAD_TIMEOUT,
+    history=chat_history,
+    history_page_size=CHAT_HISTORY_PAGE_SIZE,
+    presence_interval=CHAT_PRESENCE_TICK_MS / 1000
+)
+
+@app.on_event("startup")
+async def start_chat():
+    """Allow enough open sockets for the chat and connect its pub/sub backend"""
+    raise_open_file_limit(CHAT_OPEN_FILE_LIMIT)
+    await chat_hub.start()
+
+@app.on_event("shutdown")
+async def stop_chat():
+    """Write queued history and remove this worker's members from the shared room membership"""
+    await chat_hub.close()
+
+@app.websocket("/ws/chat/")
+async def chat_socket(websocket: WebSocket):
+    """Study room chat used by chat_room.html"""
+    await chat_hub.serve(websocket)
+
+@app.get("/chat/stats")
+async def chat_stats():
+    """Connection, room, fan-out, pub/sub, audio and history counters of the study room chat"""
+    return {
+        **chat_hub.stats(),
+        "pubsub": chat_hub.bus.stats(),
+        "audio_store": chat_audio_store.stats(),
+        "history": chat_history.stats()
+    }
+
+@app.get("/chat/audio/{digest}")
+async def get_chat_audio(digest: str, request: Request):
+    """Serve a chat audio clip, honoring single byte-range requests; clips never change"""
+    size = chat_audio_store.size(digest)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Audio clip not found")
+    
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    
+    start, end = byte_range or (0, size - 1)
+    try:
+        data = await asyncio.to_thread(chat_audio_store.read, digest, start, end)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio clip not found")
+    # Sniffing needs the first 12 bytes (WAV is identified at bytes 8-11)
+    head = data if start == 0 and len(data) >= 12 else await asyncio.to_thread(chat_audio_store.read, digest, 0, 11)
+    
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{digest}"'
+    }
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(
+        content=data,
+        status_code=206 if byte_range is not None else 200,
+        media_type=sniff_audio_type(head) or "application/octet-stream",
+        headers=headers
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        backlog=CHAT_ACCEPT_BACKLOG,
+        ws_max_size=CHAT_MAX_FRAME_BYTES,
+        ws_per_message_deflate=CHAT_WS_COMPRESSION
+    ) 
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import uuid
+
+
+class BatchQueue:
+    """In-process work queue for batch video ingestion
+
+    Items from every batch share one asyncio queue drained by a fixed number of
+    worker tasks, so a large batch is processed with bounded concurrency and
+    later batches wait their turn. Finished batches are forgotten after
+    `retention_seconds`.
+    """
+
+    def __init__(self, process_item, workers=4, retention_seconds=24 * 3600):
+        self.process_item = process_item
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+
+        self._queue = None
+        self._tasks = []
+        self._batches = {}
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def submit(self, items):
+        """Enqueue `items` and return the new batch id"""
+        self._expire()
+        self._ensure_workers()
+
+        batch_id = uuid.uuid4().hex
+        self._batches[batch_id] = {
+            "batch_id": batch_id,
+            "created_at": time.time(),
+            "finished_at": None,
+            "items": [
+                {"input": item, "status": "queued", "result": None, "error": None}
+                for item in items
+            ],
+        }
+        for index in range(len(items)):
+            self._queue.put_nowait((batch_id, index))
+        return batch_id
+
+    def status(self, batch_id):
+        """Return per-item status and results, or None for an unknown batch"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for item in batch["items"]:
+            counts[item["status"]] += 1
+        return {**batch, "counts": counts, "queue_depth": self._queue.qsize()}
+
+    async def _worker(self):
+        while True:
+            batch_id, index = await self._queue.get()
+            try:
+                batch = self._batches.get(batch_id)
+                if batch is None:
+                    continue
+                item = batch["items"][index]
+                item["status"] = "running"
+                try:
+                    item["result"] = await self.process_item(item["input"])
+                    item["status"] = "done"
+                except Exception as e:
+                    item["error"] = getattr(e, "detail", None) or str(e)
+                    item["status"] = "failed"
+                if all(i["status"] in ("done", "failed") for i in batch["items"]):
+                    batch["finished_at"] = time.time()
+            finally:
+                self._queue.task_done()
+
+    def _expire(self):
+        cutoff = time.time() - self.retention_seconds
+        for batch_id in [
+            batch_id for batch_id, batch in self._batches.items()
+            if batch["finished_at"] is not None and batch["finished_at"] < cutoff
+        ]:
+            del self._batches[batch_id]
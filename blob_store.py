@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def sniff_audio_type(data):
+    """MIME type of an audio clip from its leading bytes, or None if it is not a known audio container"""
+    if data[:4] == b"\x1a\x45\xdf\xa3":
+        return "audio/webm"
+    if data[:4] == b"OggS":
+        return "audio/ogg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "audio/wav"
+    if data[4:8] == b"ftyp":
+        return "audio/mp4"
+    if data[:3] == b"ID3" or data[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    return None
+
+
+def parse_byte_range(header, size):
+    """(start, end) inclusive for a single-range `Range` header, or None to send the whole body
+
+    Raises ValueError if the range cannot be satisfied (416).
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None:
+        # Multiple or malformed ranges: serve the whole body, which is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class BlobStore:
+    """Content-addressed files on disk
+
+    Each blob is written once under its SHA-256 (sharded by the first two hex
+    digits), so identical uploads share one file and a blob's URL never
+    changes content. Writes go to a temporary file and are renamed into
+    place. When the store grows beyond `max_bytes` the least recently
+    written blobs are deleted.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._total = 0
+        self.writes = 0
+        self.duplicates = 0
+        self.evictions = 0
+        self._scan()
+
+    # ----- public API -----
+
+    def put(self, data, digest=None):
+        """Store `data` and return its hex digest"""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if self.size(digest) is not None:
+            with self._lock:
+                self.duplicates += 1
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        with self._lock:
+            if digest not in self._sizes:
+                self._sizes[digest] = len(data)
+                self._total += len(data)
+                self.writes += 1
+            self._evict()
+        return digest
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def size(self, digest):
+        """Size in bytes, or None for an unknown digest"""
+        if not DIGEST_PATTERN.fullmatch(digest):
+            return None
+        with self._lock:
+            size = self._sizes.get(digest)
+        if size is None:
+            # Another worker sharing the directory may have written it
+            try:
+                size = os.path.getsize(self.path(digest))
+            except OSError:
+                return None
+            with self._lock:
+                if digest not in self._sizes:
+                    self._sizes[digest] = size
+                    self._total += size
+        return size
+
+    def read(self, digest, start=0, end=None):
+        """Bytes start..end (inclusive) of a blob"""
+        with open(self.path(digest), "rb") as f:
+            f.seek(start)
+            if end is None:
+                return f.read()
+            return f.read(end - start + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blobs": len(self._sizes),
+                "bytes": self._total,
+                "writes": self.writes,
+                "duplicates": self.duplicates,
+                "evictions": self.evictions,
+            }
+
+    # ----- internals -----
+
+    def _scan(self):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if DIGEST_PATTERN.fullmatch(entry.name):
+                    self._sizes[entry.name] = entry.stat().st_size
+                    self._total += self._sizes[entry.name]
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        # Rare and bounded by the number of blobs; mtime order is write order
+        by_age = sorted(self._sizes, key=lambda d: self._mtime(d))
+        for digest in by_age:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+            self._total -= self._sizes.pop(digest)
+            self.evictions += 1
+
+    def _mtime(self, digest):
+        try:
+            return os.path.getmtime(self.path(digest))
+        except OSError:
+            return time.time()
@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("chat_history")
+
+# One little-endian u64 byte offset per record
+INDEX_ENTRY = struct.Struct("<Q")
+
+
+def room_key(room):
+    """File-system safe directory name for a room"""
+    return hashlib.sha256(room.encode("utf-8")).hexdigest()[:32]
+
+
+class RoomLog:
+    """Append-only, segmented message log of one room
+
+    Segment `<base>.log` holds one serialized frame per line and
+    `<base>.idx` the byte offset of each of them, where `<base>` is the
+    sequence number of the segment's first record. A record's sequence
+    number is its position in the room's history, so reading a page is an
+    index lookup and one contiguous read. Appends hold an exclusive lock
+    on the room, so workers sharing the directory can write to it, and
+    write the log before the index: a crash can leave unindexed bytes at
+    the end of a segment, or a torn index entry, but never an index entry
+    without its record. The next append cuts both back to the last indexed
+    record before writing.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        """Base sequence numbers of the segments, ascending"""
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".idx"))
+
+    def count(self):
+        """Number of records in the log"""
+        segments = self.segments()
+        if not segments:
+            return 0
+        return segments[-1] + self._entries(segments[-1])
+
+    def append(self, frames):
+        """Append serialized frames and fsync them; returns the sequence number of the first"""
+        with open(os.path.join(self.directory, "lock"), "a+b") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            segments = self.segments()
+            base = segments[-1] if segments else 0
+            if segments:
+                self._recover(base)
+            first = base + (self._entries(base) if segments else 0)
+            if segments and os.path.getsize(self._path(base, "log")) >= self.segment_bytes:
+                base = first
+
+            with open(self._path(base, "log"), "ab") as log, open(self._path(base, "idx"), "ab") as index:
+                offset = log.seek(0, os.SEEK_END)
+                data = bytearray()
+                entries = bytearray()
+                for frame in frames:
+                    entries += INDEX_ENTRY.pack(offset + len(data))
+                    data += frame.encode("utf-8") + b"\n"
+                log.write(data)
+                log.flush()
+                os.fsync(log.fileno())
+                index.write(entries)
+                index.flush()
+                os.fsync(index.fileno())
+            return first
+
+    def read(self, start, end):
+        """Frames with sequence numbers start..end-1"""
+        frames = []
+        segments = self.segments()
+        for i, base in enumerate(segments):
+            limit = segments[i + 1] if i + 1 < len(segments) else base + self._entries(base)
+            lo, hi = max(start, base), min(end, limit)
+            if lo >= hi:
+                continue
+            with open(self._path(base, "idx"), "rb") as index:
+                index.seek((lo - base) * INDEX_ENTRY.size)
+                offset = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+                # The next record's offset bounds the read; the last record runs to its newline
+                following = index.read(INDEX_ENTRY.size * (hi - lo))[-INDEX_ENTRY.size:] if hi < limit else b""
+            with open(self._path(base, "log"), "rb") as log:
+                log.seek(offset)
+                if len(following) == INDEX_ENTRY.size:
+                    data = log.read(INDEX_ENTRY.unpack(following)[0] - offset)
+                else:
+                    data = log.read()
+            frames.extend(line.decode("utf-8") for line in data.split(b"\n")[:hi - lo])
+        return frames
+
+    def _recover(self, base):
+        """Truncate a segment to its indexed records, dropping what an interrupted append left"""
+        entries = self._entries(base)
+        with open(self._path(base, "idx"), "r+b") as index:
+            if index.seek(0, os.SEEK_END) != entries * INDEX_ENTRY.size:
+                index.truncate(entries * INDEX_ENTRY.size)
+            last = None
+            if entries:
+                index.seek((entries - 1) * INDEX_ENTRY.size)
+                last = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))[0]
+
+        with open(self._path(base, "log"), "r+b") as log:
+            end = 0
+            if last is not None:
+                log.seek(last)
+                # The last indexed record ends at its newline; anything after it was never indexed
+                data = log.read()
+                newline = data.find(b"\n")
+                end = last + (newline + 1 if newline >= 0 else len(data))
+            if log.seek(0, os.SEEK_END) > end:
+                logger.warning("Dropping %d unindexed bytes from %s", log.tell() - end, self._path(base, "log"))
+                log.truncate(end)
+
+    def _entries(self, base):
+        try:
+            return os.path.getsize(self._path(base, "idx")) // INDEX_ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def _path(self, base, extension):
+        return os.path.join(self.directory, f"{base:020d}.{extension}")
+
+
+class _RoomHistory:
+    __slots__ = ("log", "ring", "ring_end", "pending", "lock")
+
+    def __init__(self, log, ring_size):
+        self.log = log
+        # Held while writing and while assembling the latest page, so a page
+        # never sees a batch both on disk and still queued
+        self.lock = asyncio.Lock()
+        # (seq, frame) of the most recent records known to be on disk
+        self.ring = deque(maxlen=ring_size)
+        self.ring_end = 0
+        # Frames appended by this process and not yet written
+        self.pending = []
+
+    def extend(self, first, frames):
+        """Add on-disk records first.. to the ring, keeping it contiguous"""
+        if first > self.ring_end or not self.ring:
+            self.ring.clear()
+            self.ring_end = first
+        for seq, frame in enumerate(frames, first):
+            if seq == self.ring_end:
+                self.ring.append((seq, frame))
+                self.ring_end += 1
+
+
+class ChatHistory:
+    """Per-room message history in two tiers
+
+    The last `ring_size` messages of each room are kept in memory; every
+    message is also appended to the room's RoomLog on disk. `append` only
+    queues the frame, and a background task writes and fsyncs everything
+    queued every `flush_interval` seconds on a worker thread, so disk I/O
+    never sits on the message path. Pages are served from the ring when it
+    covers them and from the log otherwise; messages not yet flushed are
+    included at the end of the latest page.
+    """
+
+    def __init__(self, directory, ring_size=100, segment_bytes=8 * 1024 * 1024, flush_interval=0.5):
+        self.directory = directory
+        self.ring_size = ring_size
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._rooms = {}
+        self._task = None
+        self.appended = 0
+        self.flushes = 0
+        self.ring_reads = 0
+        self.disk_reads = 0
+
+    # ----- lifecycle -----
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flusher())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+    # ----- public API -----
+
+    def append(self, room, frame):
+        """Queue a serialized frame for `room`'s history"""
+        self._room(room).pending.append(frame)
+        self.appended += 1
+
+    async def page(self, room, before=None, limit=50):
+        """Return (frames, cursor, has_more), oldest first
+
+        Without `before` this is the latest page, including unflushed
+        messages; it ends with everything appended up to the moment it
+        returns, so a caller that subscribes the client right after misses
+        nothing. `cursor` is the sequence number to pass as `before` for the
+        previous page.
+        """
+        state = self._room(room)
+        if before is not None:
+            start = max(before - limit, 0)
+            return await self._read(state, start, before), start, start > 0
+
+        if len(state.pending) >= limit:
+            # Unflushed messages have no sequence number to page back from
+            await self._flush_room(state)
+        async with state.lock:
+            # Other workers may have written to the log since the ring was filled
+            count = await asyncio.to_thread(state.log.count)
+            if count > state.ring_end:
+                start = max(state.ring_end, count - self.ring_size)
+                state.extend(start, await asyncio.to_thread(state.log.read, start, count))
+                self.disk_reads += 1
+            # Flushes wait for the lock, so pending only grows at its end from here on
+            first_pending = max(len(state.pending) - limit, 0)
+            before = state.ring_end
+            start = max(before - (limit - (len(state.pending) - first_pending)), 0)
+            frames = await self._read(state, start, before)
+            return frames + state.pending[first_pending:], start, start > 0
+
+    async def flush(self):
+        """Write all queued frames to disk, rooms in parallel"""
+        rooms = [state for state in self._rooms.values() if state.pending]
+        if rooms:
+            await asyncio.gather(*(self._flush_room(state) for state in rooms))
+            self.flushes += 1
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "appended": self.appended,
+            "pending": sum(len(state.pending) for state in self._rooms.values()),
+            "flushes": self.flushes,
+            "ring_reads": self.ring_reads,
+            "disk_reads": self.disk_reads,
+        }
+
+    # ----- internals -----
+
+    async def _read(self, state, start, end):
+        if start >= end:
+            return []
+        if state.ring and state.ring[0][0] <= start and end <= state.ring_end:
+            offset = start - state.ring[0][0]
+            self.ring_reads += 1
+            return [frame for _, frame in list(state.ring)[offset:offset + end - start]]
+        self.disk_reads += 1
+        return await asyncio.to_thread(state.log.read, start, end)
+
+    def _room(self, room):
+        state = self._rooms.get(room)
+        if state is None:
+            log = RoomLog(os.path.join(self.directory, room_key(room)), self.segment_bytes)
+            state = self._rooms[room] = _RoomHistory(log, self.ring_size)
+        return state
+
+    async def _flush_room(self, state):
+        async with state.lock:
+            # A copy: appends keep arriving while the batch is written
+            frames = list(state.pending)
+            if not frames:
+                return
+            try:
+                first = await asyncio.to_thread(state.log.append, frames)
+            except OSError:
+                # Keep the frames queued and retry on the next tick
+                logger.exception("Failed to write chat history")
+                return
+            del state.pending[:len(frames)]
+            state.extend(first, frames)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Chat history flush failed")
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger("chat_pubsub")
+
+
+class InProcessPubSub:
+    """Room broadcast and membership for a single worker
+
+    With one process every member is local, so published frames have no one
+    else to reach; this only keeps the room list and the versioned
+    membership that ChatHub builds user_list snapshots and presence from.
+    """
+
+    def __init__(self):
+        self._rooms = []
+        self._members = {}
+        self._versions = {}
+
+    async def start(self, on_message):
+        self._on_message = on_message
+
+    async def close(self):
+        pass
+
+    async def subscribe(self, room):
+        pass
+
+    async def unsubscribe(self, room):
+        pass
+
+    def publish(self, room, frame):
+        pass
+
+    def publish_presence(self, room, entries):
+        pass
+
+    def publish_control(self, payload):
+        pass
+
+    async def rooms(self):
+        return list(self._rooms)
+
+    async def add_room(self, room):
+        """Add `room`; returns (created, all rooms)"""
+        if room in self._rooms:
+            return False, list(self._rooms)
+        self._rooms.append(room)
+        return True, list(self._rooms)
+
+    async def join(self, room, member_id, username):
+        """Add a member; returns (version, {member_id: username}, departed)
+
+        `departed` lists [version, username, -1] for stale members removed
+        along the way (only the shared backend has those).
+        """
+        self._members.setdefault(room, {})[member_id] = username
+        return self._bump(room), dict(self._members[room]), []
+
+    async def leave(self, room, member_id):
+        """Remove a member; returns the room's new version"""
+        self._members.get(room, {}).pop(member_id, None)
+        return self._bump(room)
+
+    def stats(self):
+        return {"backend": "memory"}
+
+    def _bump(self, room):
+        self._versions[room] = self._versions.get(room, 0) + 1
+        return self._versions[room]
+
+
+class RedisPubSub:
+    """Room broadcast and membership shared by all workers through Redis
+
+    Every worker subscribes to the channels of rooms it has local members in
+    and fans incoming frames out to them. Publishes are buffered for
+    `flush_interval` seconds and sent as one pipeline, with all frames for a
+    channel packed into a single PUBLISH, so a burst of messages costs one
+    round trip instead of one per message.
+
+    Membership lives in one hash per room (field "<worker>:<connection>")
+    next to a version counter bumped in the same transaction, so snapshots
+    and presence changes are ordered per room across workers. Workers
+    refresh a heartbeat key; members of a worker whose heartbeat expired (a
+    crash), and members this worker no longer has (a failed removal), are
+    pruned when the next member joins the room.
+    """
+
+    def __init__(self, url, prefix="chat", flush_interval=0.005, max_batch=500, heartbeat_seconds=10.0,
+                 max_connections=16):
+        if aioredis is None:
+            raise RuntimeError("The redis package is required for the Redis chat backend")
+        self.url = url
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_connections = max_connections
+        self.worker_id = uuid.uuid4().hex[:12]
+
+        self._redis = None
+        self._pubsub = None
+        self._tasks = []
+        self._pending = {}
+        self._pending_count = 0
+        self._flush_wanted = None
+        self._local_members = {}
+
+        self.published = 0
+        self.flushes = 0
+        self.received = 0
+
+    # ----- lifecycle -----
+
+    async def start(self, on_message):
+        """Connect and deliver remote traffic as `on_message(kind, room, data)`
+
+        kind is "room" (data: list of frames), "presence" (data: list of
+        [version, username, delta]) or "control" (data: dict, room None).
+        """
+        self._on_message = on_message
+        # A disconnect storm must queue for connections, not open hundreds of them
+        pool = aioredis.BlockingConnectionPool.from_url(
+            self.url, max_connections=self.max_connections, decode_responses=True
+        )
+        self._redis = aioredis.Redis(connection_pool=pool)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self._key("control"))
+        self._flush_wanted = asyncio.Event()
+        await self._beat()
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._flusher()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+
+    async def close(self):
+        await self._flush()
+        for task in self._tasks:
+            task.cancel()
+        pipe = self._redis.pipeline(transaction=False)
+        for room, fields in self._local_members.items():
+            if fields:
+                pipe.hdel(self._key("members", room), *fields)
+        pipe.delete(self._key("worker", self.worker_id))
+        await pipe.execute()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    # ----- broadcast -----
+
+    async def subscribe(self, room):
+        await self._pubsub.subscribe(self._key("room", room), self._key("presence", room))
+
+    async def unsubscribe(self, room):
+        await self._pubsub.unsubscribe(self._key("room", room), self._key("presence", room))
+
+    def publish(self, room, frame):
+        """Queue a serialized frame for the other workers' members of `room`"""
+        self._queue(self._key("room", room), frame)
+
+    def publish_presence(self, room, entries):
+        self._queue(self._key("presence", room), json.dumps(entries))
+
+    def publish_control(self, payload):
+        self._queue(self._key("control"), json.dumps(payload))
+
+    # ----- rooms and membership -----
+
+    async def rooms(self):
+        return await self._redis.zrange(self._key("rooms"), 0, -1)
+
+    async def add_room(self, room):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.zadd(self._key("rooms"), {room: time.time()}, nx=True)
+        pipe.zrange(self._key("rooms"), 0, -1)
+        added, rooms = await pipe.execute()
+        return bool(added), rooms
+
+    async def join(self, room, member_id, username):
+        field = f"{self.worker_id}:{member_id}"
+        self._local_members.setdefault(room, set()).add(field)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hset(self._key("members", room), field, username)
+        pipe.incr(self._key("version", room))
+        pipe.hgetall(self._key("members", room))
+        _, version, members = await pipe.execute()
+        members, departed = await self._prune(room, members)
+        return version, members, departed
+
+    async def leave(self, room, member_id):
+        field = f"{self.worker_id}:{member_id}"
+        self._local_members.get(room, set()).discard(field)
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hdel(self._key("members", room), field)
+        pipe.incr(self._key("version", room))
+        _, version = await pipe.execute()
+        return version
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "flushes": self.flushes,
+            "received": self.received,
+            "pending": self._pending_count,
+        }
+
+    # ----- internals -----
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def _queue(self, channel, data):
+        self._pending.setdefault(channel, []).append(data)
+        self._pending_count += 1
+        self.published += 1
+        self._flush_wanted.set()
+
+    async def _flusher(self):
+        while True:
+            await self._flush_wanted.wait()
+            # Let a burst accumulate unless the batch is already full
+            if self._pending_count < self.max_batch:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Failed to publish chat frames")
+
+    async def _flush(self):
+        self._flush_wanted.clear()
+        if not self._pending:
+            return
+        pending, self._pending, self._pending_count = self._pending, {}, 0
+        pipe = self._redis.pipeline(transaction=False)
+        for channel, items in pending.items():
+            # json.dumps never emits raw newlines, so they can separate frames
+            pipe.publish(channel, self.worker_id + "\n" + "\n".join(items))
+        await pipe.execute()
+        self.flushes += 1
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Chat subscription failed; reconnecting")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            origin, _, body = message["data"].partition("\n")
+            if origin == self.worker_id:
+                continue
+            self.received += 1
+            kind, _, room = message["channel"][len(self.prefix) + 1:].partition(":")
+            items = body.split("\n")
+            try:
+                if kind == "room":
+                    self._on_message("room", room, items)
+                else:
+                    for item in items:
+                        self._on_message(kind, room or None, json.loads(item))
+            except Exception:
+                logger.exception("Failed to deliver chat frames")
+
+    async def _beat(self):
+        await self._redis.set(
+            self._key("worker", self.worker_id), 1, ex=max(int(self.heartbeat_seconds * 3), 1)
+        )
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self._beat()
+            except Exception:
+                logger.exception("Chat heartbeat failed")
+
+    async def _prune(self, room, members):
+        """Drop members whose worker stopped sending heartbeats or that this worker no longer has"""
+        local = self._local_members.get(room, set())
+        stale = [
+            field for field in members
+            if field.split(":", 1)[0] == self.worker_id and field not in local
+        ]
+        workers = sorted({field.split(":", 1)[0] for field in members} - {self.worker_id})
+        if workers:
+            alive = await self._redis.mget([self._key("worker", worker) for worker in workers])
+            dead = {worker for worker, beat in zip(workers, alive) if beat is None}
+            stale += [field for field in members if field.split(":", 1)[0] in dead]
+        if not stale:
+            return members, []
+        pipe = self._redis.pipeline(transaction=False)
+        for field in stale:
+            pipe.hdel(self._key("members", room), field)
+            pipe.incr(self._key("version", room))
+        results = await pipe.execute()
+        # Only removals this call actually made are announced
+        departed = [
+            [version, members[field], -1]
+            for field, removed, version in zip(stale, results[0::2], results[1::2]) if removed
+        ]
+        return {field: name for field, name in members.items() if field not in stale}, departed
@@ -0,0 +1,540 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import time
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from blob_store import sniff_audio_type
+from chat_pubsub import InProcessPubSub
+
+logger = logging.getLogger("chat_server")
+
+DEFAULT_ROOM = "General Discussion"
+
+# WebSocket close code for a client that cannot keep up with its room
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def raise_open_file_limit(target=65536):
+    """Raise the soft open-file limit towards `target` (each connection is a file descriptor)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = target if hard == resource.RLIM_INFINITY else min(target, hard)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        soft = wanted
+    return soft
+
+
+class AudioUpload:
+    """An audio clip arriving as binary frames after an audio_start message"""
+
+    __slots__ = ("size", "data", "hasher", "timer")
+
+    def __init__(self, size, timer):
+        self.size = size
+        self.data = bytearray()
+        self.hasher = hashlib.sha256()
+        self.timer = timer
+
+
+class ChatConnection:
+    """One connected client: its socket, identity, room and outgoing queue"""
+
+    __slots__ = ("id", "websocket", "username", "room", "queue", "closing", "tokens", "refilled_at", "upload")
+
+    def __init__(self, conn_id, websocket, queue_size):
+        self.id = conn_id
+        self.websocket = websocket
+        self.username = "Anonymous"
+        self.room = None
+        self.queue = asyncio.Queue(queue_size)
+        self.closing = False
+        self.tokens = 0.0
+        self.refilled_at = 0.0
+        self.upload = None
+
+    def send(self, text):
+        """Queue a frame without waiting; False if the client is too far behind"""
+        if self.closing:
+            return False
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+
+class ChatHub:
+    """Rooms and connections of the study room chat (the chat_room.html protocol)
+
+    Each room is a set of connections. A message is serialized once and then
+    put on every member's bounded send queue without awaiting, so fan-out is
+    O(members), touches only that room, and needs no locks since everything
+    runs on the event loop. Each connection has a writer task that drains its
+    queue; a client whose queue fills up is disconnected rather than letting
+    it hold back the room or grow memory. Senders are rate limited (token
+    bucket) so one client cannot flood a room faster than it can be read.
+
+    With several workers, `bus` (see chat_pubsub) carries frames to the
+    members connected to other processes and holds the shared room list and
+    membership; frames arriving from the bus are fanned out the same way.
+
+    Audio is uploaded as binary frames of at most `max_chunk_bytes` after an
+    audio_start {size} message, stored once in `blob_store` under its hash,
+    and broadcast as a small reference the clients fetch (with range
+    requests) from `audio_url`, so fan-out cost does not depend on clip size.
+
+    Chat and audio messages are recorded in `history` (see chat_history);
+    joining a room sends its latest page and load_history {before} pages
+    back from a cursor.
+
+    Presence is sent as deltas: a joining client gets one user_list
+    snapshot, and members hear about joins and leaves through presence
+    messages carrying [version, username, +1/-1] entries, coalesced per
+    room every `presence_interval` seconds. A join storm in a big room then
+    costs each member a few small messages instead of a full list per join.
+    Versions come from the bus and increase per room, so clients skip
+    entries already reflected in their snapshot.
+
+    Client messages: join_room {room, username}, create_room {room},
+    chat {message}, audio_start {size} + binary frames, load_history {before}.
+    Server messages: chat, audio {audio_id, url, size, content_type},
+    history {messages, cursor, has_more, initial},
+    user_list {version, users: [{username, online, connections}]},
+    presence {changes: [[version, username, delta]]}, room_list {rooms}, error.
+    """
+
+    def __init__(self, bus=None, default_rooms=(DEFAULT_ROOM,), queue_size=256, max_rooms=1000,
+                 max_message_chars=4000, max_audio_bytes=2 * 1024 * 1024,
+                 max_name_chars=64, rate_per_second=5.0, rate_burst=20,
+                 blob_store=None, audio_url="/chat/audio/{digest}", max_chunk_bytes=64 * 1024,
+                 max_uploads=256, upload_timeout=60.0, history=None, history_page_size=50,
+                 presence_interval=0.1):
+        self.bus = bus or InProcessPubSub()
+        self.default_rooms = default_rooms
+        # Room name -> local connections in it, in room list order
+        self.rooms = {}
+        self.connections = set()
+        self.queue_size = queue_size
+        self.max_rooms = max_rooms
+        self.max_message_chars = max_message_chars
+        self.max_audio_bytes = max_audio_bytes
+        self.max_name_chars = max_name_chars
+        self.rate_per_second = rate_per_second
+        self.rate_burst = rate_burst
+        self.blob_store = blob_store
+        self.audio_url = audio_url
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_uploads = max_uploads
+        self.upload_timeout = upload_timeout
+        self.history = history
+        self.history_page_size = history_page_size
+        self.presence_interval = presence_interval
+        self._uploads = 0
+
+        self._room_list = None
+        self._ids = itertools.count(1)
+        # Room -> presence changes waiting for the next tick
+        self._presence = {}
+        self._presence_task = None
+        self.presence_entries = 0
+        self.presence_frames = 0
+        self.messages = 0
+        self.deliveries = 0
+        self.slow_disconnects = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.audio_clips = 0
+        self.audio_bytes = 0
+
+    # ----- public API -----
+
+    async def start(self):
+        """Connect the bus and load the shared room list"""
+        await self.bus.start(self._on_remote)
+        if self.history is not None:
+            await self.history.start()
+        self._presence_task = asyncio.create_task(self._presence_ticker())
+        for room in self.default_rooms:
+            await self.bus.add_room(room)
+        self._set_rooms(await self.bus.rooms())
+
+    async def close(self):
+        if self._presence_task is not None:
+            self._presence_task.cancel()
+        if self.history is not None:
+            await self.history.close()
+        await self.bus.close()
+
+    async def serve(self, websocket: WebSocket):
+        """Run one client connection until it disconnects"""
+        await websocket.accept()
+        conn = ChatConnection(next(self._ids), websocket, self.queue_size)
+        self.connections.add(conn)
+        writer = asyncio.create_task(self._write(conn))
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    await self._receive_chunk(conn, message.get("bytes") or b"")
+                    continue
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    self._error(conn, "Malformed message")
+                    continue
+                if isinstance(data, dict):
+                    await self.handle(conn, data)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.connections.discard(conn)
+            self._cancel_upload(conn)
+            writer.cancel()
+            await self.leave(conn)
+
+    async def handle(self, conn, data):
+        """Dispatch one client message"""
+        kind = data.get("type")
+        if kind == "join_room":
+            await self.join(conn, data.get("room"), data.get("username"))
+        elif kind == "create_room":
+            await self.create_room(conn, data.get("room"))
+        elif kind == "chat":
+            message = str(data.get("message", "")).strip()
+            if not message or len(message) > self.max_message_chars:
+                self._error(conn, f"Messages must be 1-{self.max_message_chars} characters")
+                return
+            self._relay(conn, {"type": "chat", "message": message})
+        elif kind == "load_history":
+            before = data.get("before")
+            if self.history is None or conn.room is None or not isinstance(before, int) or before < 0:
+                self._error(conn, "load_history needs a joined room and a cursor")
+                return
+            conn.send(await self._history_frame(conn.room, before))
+        elif kind == "audio_start":
+            self._start_upload(conn, data.get("size"))
+        elif kind == "audio":
+            self._error(conn, "Send audio as binary frames after an audio_start message")
+        else:
+            self._error(conn, f"Unknown message type: {kind}")
+
+    async def join(self, conn, room, username=None):
+        room = self._clean_name(room)
+        if room is None or room not in self.rooms:
+            self._error(conn, "Unknown room")
+            return
+        if username:
+            conn.username = str(username).strip()[:self.max_name_chars] or conn.username
+        await self.leave(conn)
+        conn.send(self._room_list_frame())
+        history = await self._history_frame(room) if self.history is not None else None
+        # No await between the history page and membership, so no message falls in between
+        conn.room = room
+        members = self.rooms[room]
+        members.add(conn)
+        if history is not None:
+            conn.send(history)
+        if len(members) == 1:
+            await self.bus.subscribe(room)
+        version, users, departed = await self.bus.join(room, conn.id, conn.username)
+        # The joiner gets the full list once; everyone else only hears about the change
+        conn.send(self._user_list_frame(room, version, users))
+        self._presence_change(room, [[version, conn.username, 1], *departed])
+
+    async def leave(self, conn):
+        room = conn.room
+        if room is None:
+            return
+        conn.room = None
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                await self.bus.unsubscribe(room)
+        try:
+            version = await self.bus.leave(room, conn.id)
+        except Exception:
+            # The next membership change of the room prunes this member
+            logger.exception("Failed to remove chat member")
+            return
+        self._presence_change(room, [[version, conn.username, -1]])
+
+    async def create_room(self, conn, room):
+        room = self._clean_name(room)
+        if room is None:
+            self._error(conn, f"Room names must be 1-{self.max_name_chars} characters")
+            return
+        if room in self.rooms:
+            conn.send(self._room_list_frame())
+            return
+        if len(self.rooms) >= self.max_rooms:
+            self._error(conn, "Too many rooms")
+            return
+        created, rooms = await self.bus.add_room(room)
+        if created:
+            self.bus.publish_control({"type": "room_list", "rooms": rooms})
+        self._set_rooms(rooms)
+
+    def broadcast(self, room, payload, record=False):
+        """Send `payload` to every member of `room`, on this worker and through the bus
+
+        With `record` the message is also added to the room's history.
+        """
+        frame = json.dumps(payload)
+        self.bus.publish(room, frame)
+        if record and self.history is not None:
+            self.history.append(room, frame)
+        return self._fan_out(room, frame)
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "rooms": len(self.rooms),
+            "largest_room": max((len(m) for m in self.rooms.values()), default=0),
+            "messages": self.messages,
+            "deliveries": self.deliveries,
+            "slow_disconnects": self.slow_disconnects,
+            "rate_limited": self.rate_limited,
+            "presence_entries": self.presence_entries,
+            "presence_frames": self.presence_frames,
+            "uploads_in_progress": self._uploads,
+            "audio_clips": self.audio_clips,
+            "audio_bytes": self.audio_bytes,
+            "rejected": self.rejected,
+        }
+
+    # ----- internals -----
+
+    def _relay(self, conn, payload, rate_limited=True):
+        if conn.room is None:
+            self._error(conn, "Join a room first")
+            return
+        if rate_limited and not self._take_token(conn):
+            self.rate_limited += 1
+            conn.send(json.dumps({"type": "error", "message": "Sending too fast; message dropped"}))
+            return
+        self.messages += 1
+        self.broadcast(conn.room, {
+            **payload,
+            "room": conn.room,
+            "username": conn.username,
+            "timestamp": time.time(),
+        }, record=True)
+
+    async def _history_frame(self, room, before=None):
+        frames, cursor, has_more = await self.history.page(room, before, self.history_page_size)
+        # Stored frames are already JSON; splice them in instead of re-encoding
+        return (
+            f'{{"type": "history", "room": {json.dumps(room)}, "initial": {json.dumps(before is None)}, '
+            f'"cursor": {cursor}, "has_more": {json.dumps(has_more)}, "messages": [{", ".join(frames)}]}}'
+        )
+
+    def _start_upload(self, conn, size):
+        if self.blob_store is None:
+            self._error(conn, "Audio messages are not enabled")
+            return
+        if conn.room is None:
+            self._error(conn, "Join a room first")
+            return
+        if not isinstance(size, int) or not 0 < size <= self.max_audio_bytes:
+            self._error(conn, f"Audio clips must be 1-{self.max_audio_bytes} bytes")
+            return
+        self._cancel_upload(conn)
+        if self._uploads >= self.max_uploads:
+            self._error(conn, "Too many audio uploads in progress; try again shortly")
+            return
+        if not self._take_token(conn):
+            self.rate_limited += 1
+            self._error(conn, "Sending too fast; audio dropped")
+            return
+        timer = asyncio.get_running_loop().call_later(self.upload_timeout, self._expire_upload, conn)
+        conn.upload = AudioUpload(size, timer)
+        self._uploads += 1
+
+    def _expire_upload(self, conn):
+        if conn.upload is not None:
+            self._cancel_upload(conn)
+            self._error(conn, "Audio upload timed out")
+
+    def _cancel_upload(self, conn):
+        upload = conn.upload
+        if upload is None:
+            return
+        upload.timer.cancel()
+        conn.upload = None
+        self._uploads -= 1
+
+    async def _receive_chunk(self, conn, chunk):
+        upload = conn.upload
+        if upload is None:
+            self._error(conn, "Unexpected binary frame; send audio_start first")
+            return
+        if len(chunk) > self.max_chunk_bytes or len(upload.data) + len(chunk) > upload.size:
+            self._cancel_upload(conn)
+            self._error(conn, f"Audio chunks are limited to {self.max_chunk_bytes} bytes and the announced size")
+            return
+        upload.data += chunk
+        upload.hasher.update(chunk)
+        if len(upload.data) < upload.size:
+            return
+
+        self._cancel_upload(conn)
+        data = bytes(upload.data)
+        content_type = sniff_audio_type(data)
+        if content_type is None:
+            self._error(conn, "Unsupported audio format")
+            return
+        digest = upload.hasher.hexdigest()
+        await asyncio.to_thread(self.blob_store.put, data, digest)
+        self.audio_clips += 1
+        self.audio_bytes += len(data)
+        self._relay(conn, {
+            "type": "audio",
+            "audio_id": digest,
+            "url": self.audio_url.format(digest=digest),
+            "size": len(data),
+            "content_type": content_type,
+        }, rate_limited=False)
+
+    def _take_token(self, conn):
+        now = time.monotonic()
+        if conn.refilled_at == 0.0:
+            conn.tokens = float(self.rate_burst)
+        else:
+            conn.tokens = min(self.rate_burst, conn.tokens + (now - conn.refilled_at) * self.rate_per_second)
+        conn.refilled_at = now
+        if conn.tokens < 1.0:
+            return False
+        conn.tokens -= 1.0
+        return True
+
+    def _fan_out(self, room, frame):
+        """Queue `frame` to this worker's members of `room`; returns the number of recipients"""
+        members = self.rooms.get(room)
+        if not members:
+            return 0
+        # Copy: slow consumers are removed from the set while iterating
+        for member in list(members):
+            self._deliver(member, frame)
+        self.deliveries += len(members)
+        return len(members)
+
+    def _on_remote(self, kind, room, data):
+        """Frames and events published by other workers"""
+        if kind == "room":
+            for frame in data:
+                self._fan_out(room, frame)
+        elif kind == "presence":
+            self._queue_presence(room, data)
+        elif kind == "control" and data.get("type") == "room_list":
+            self._set_rooms(data["rooms"])
+
+    def _set_rooms(self, rooms):
+        """Adopt the shared room list and push it to every client if it changed"""
+        added = [room for room in rooms if room not in self.rooms]
+        if not added and self._room_list is not None:
+            return
+        for room in added:
+            self.rooms[room] = set()
+        self._room_list = None
+        # Room creation is rare; every client's sidebar lists all rooms
+        frame = self._room_list_frame()
+        for conn in list(self.connections):
+            self._deliver(conn, frame)
+
+    def _deliver(self, conn, frame):
+        if not conn.send(frame) and not conn.closing:
+            self.slow_disconnects += 1
+            self._drop(conn)
+
+    def _drop(self, conn):
+        """Disconnect a client that stopped reading; its reader loop does the cleanup"""
+        conn.closing = True
+        if conn.room is not None:
+            self.rooms[conn.room].discard(conn)
+        asyncio.ensure_future(self._close(conn))
+
+    async def _close(self, conn):
+        try:
+            await conn.websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        except Exception:
+            pass
+
+    async def _write(self, conn):
+        websocket = conn.websocket
+        try:
+            while True:
+                await websocket.send_text(await conn.queue.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket went away; the reader loop sees the disconnect
+            conn.closing = True
+
+    def _user_list_frame(self, room, version, members):
+        """Snapshot of `members` ({member id: username}) with connection counts per user"""
+        counts = {}
+        for name in members.values():
+            counts[name] = counts.get(name, 0) + 1
+        return json.dumps({
+            "type": "user_list",
+            "room": room,
+            "version": version,
+            "users": [
+                {"username": name, "online": True, "connections": counts[name]} for name in sorted(counts)
+            ],
+        })
+
+    def _presence_change(self, room, entries):
+        """Share membership changes ([version, username, +1/-1]) with this and the other workers"""
+        self.bus.publish_presence(room, entries)
+        self._queue_presence(room, entries)
+
+    def _queue_presence(self, room, entries):
+        if self.rooms.get(room):
+            self._presence.setdefault(room, []).extend(entries)
+            self.presence_entries += len(entries)
+
+    def _flush_presence(self):
+        """Send each room's queued changes as one presence message"""
+        pending, self._presence = self._presence, {}
+        for room, entries in pending.items():
+            self.presence_frames += self._fan_out(room, json.dumps({
+                "type": "presence",
+                "room": room,
+                "changes": entries,
+            }))
+
+    async def _presence_ticker(self):
+        while True:
+            await asyncio.sleep(self.presence_interval)
+            if self._presence:
+                self._flush_presence()
+
+    def _room_list_frame(self):
+        if self._room_list is None:
+            self._room_list = json.dumps({"type": "room_list", "rooms": list(self.rooms)})
+        return self._room_list
+
+    def _clean_name(self, name):
+        if not isinstance(name, str):
+            return None
+        name = name.strip()
+        if not name or len(name) > self.max_name_chars:
+            return None
+        return name
+
+    def _error(self, conn, message):
+        self.rejected += 1
+        conn.send(json.dumps({"type": "error", "message": message}))
@@ -12,6 +12,8 @@ from pytube import YouTube
 from youtube_transcript_api import YouTubeTranscriptApi
 from urllib.parse import urlencode, quote
 from bs4 import BeautifulSoup
+from llm_cache import LLMCache
+from transcript import Transcript
 
 # Configure page
 st.set_page_config(
@@ -48,18 +50,45 @@ if "http_session" not in st.session_state:
     st.session_state.http_session = requests.Session()
 
 # Initialize Gemini model
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
 model = genai.GenerativeModel(
     model_name="gemini-1.5-pro",
-    generation_config={
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-    }
+    generation_config=GENERATION_CONFIG
 )
 
+@st.cache_resource
+def get_llm_cache():
+    """Gemini response cache shared across reruns and with api.py"""
+    return LLMCache(os.path.join(os.environ.get("CACHE_DIR", "cache"), "llm_cache.db"))
+
+llm_cache = get_llm_cache()
+
 # ===== LEARNING ASSISTANT FUNCTIONS =====
 
+def parse_json_response(text):
+    """Parse a JSON model response, stripping markdown code fences"""
+    json_str = text.strip()
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[1].split('```')[0]
+    elif '```' in json_str:
+        json_str = json_str.split('```')[1].split('```')[0]
+    return json.loads(json_str.strip())
+
+def parse_quiz_response(text):
+    """Parse and validate a quiz response"""
+    quiz_data = parse_json_response(text)
+    
+    # Validate quiz format
+    if not isinstance(quiz_data, list) or len(quiz_data) == 0:
+        raise ValueError("Invalid quiz format")
+    
+    return quiz_data
+
 def generate_summary(text):
     """Generate summary using Gemini"""
     try:
@@ -69,8 +98,10 @@ def generate_summary(text):
         Provide a clear, structured summary that captures the main points and key insights.
         """
         
-        response = model.generate_content(summary_prompt)
-        return response.text
+        return llm_cache.generate(
+            model, summary_prompt, "summary", text,
+            task_type="summary", generation_config=GENERATION_CONFIG
+        )
     except Exception as e:
         st.error(f"Error generating summary: {str(e)}")
         return "Could not generate summary."
@@ -88,8 +119,10 @@ def generate_notes(text):
         - Bullet points for clarity
         """
         
-        response = model.generate_content(notes_prompt)
-        return response.text
+        return llm_cache.generate(
+            model, notes_prompt, "notes", text,
+            task_type="notes", generation_config=GENERATION_CONFIG
+        )
     except Exception as e:
         st.error(f"Error generating notes: {str(e)}")
         return "Could not generate study notes."
@@ -106,13 +139,15 @@ def get_qa_response(question, context):
         Provide a detailed, accurate answer using only information from the content.
         """
         
-        response = model.generate_content(qa_prompt)
-        return response.text
+        return llm_cache.generate(
+            model, qa_prompt, "qa", [question, context],
+            task_type="qa", generation_config=GENERATION_CONFIG
+        )
     except Exception as e:
         st.error(f"Error answering question: {str(e)}")
         return "Could not answer the question."
 
-def generate_quiz(text):
+def generate_quiz(text, bypass_cache=False):
     """Generate quiz questions using Gemini"""
     try:
         quiz_prompt = f"""Create a quiz based on this content. Format your response as a valid JSON array of questions.
@@ -135,25 +170,11 @@ def generate_quiz(text):
         Ensure the response is ONLY the JSON array with no additional text.
         """
         
-        response = model.generate_content(quiz_prompt)
-        quiz_text = response.text.strip()
-        
-        # Clean the response to ensure valid JSON
-        if "```json" in quiz_text:
-            quiz_text = quiz_text.split("```json")[1].split("```")[0]
-        elif "```" in quiz_text:
-            quiz_text = quiz_text.split("```")[1]
-            
-        quiz_text = quiz_text.strip()
-        
-        # Parse JSON
-        quiz_data = json.loads(quiz_text)
-        
-        # Validate quiz format
-        if not isinstance(quiz_data, list) or len(quiz_data) == 0:
-            raise ValueError("Invalid quiz format")
-            
-        return quiz_data
+        return llm_cache.generate(
+            model, quiz_prompt, "quiz", text,
+            task_type="quiz", generation_config=GENERATION_CONFIG, bypass=bypass_cache,
+            parse=parse_quiz_response
+        )
         
     except json.JSONDecodeError as e:
         st.error(f"Error parsing quiz response: {str(e)}")
@@ -217,13 +238,12 @@ def process_video(url):
         
         # Get video transcript
         try:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id)
+            transcript = Transcript.from_segments(YouTubeTranscriptApi.get_transcript(video_id))
         except Exception as e:
             st.error(f"Error getting transcript: {str(e)}")
             return False
         
-        # Combine transcript text
-        full_text = " ".join([entry["text"] for entry in transcript])
+        full_text = transcript.full_text
         
         # Generate summary and notes
         with st.spinner("Generating summary..."):
@@ -326,13 +346,11 @@ Return the response STRICTLY in this JSON format:
 Make the flow practical, actionable, and comprehensive."""
 
     try:
-        response = model.generate_content(prompt)
-        json_str = response.text.strip()
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0]
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].split('```')[0]
-        return json.loads(json_str)
+        return llm_cache.generate(
+            model, prompt, "learning_path_with_resources", [topic, objective],
+            task_type="learning_path", generation_config=GENERATION_CONFIG,
+            parse=parse_json_response
+        )
     except Exception as e:
         st.error(f"Error generating content: {str(e)}")
         return None
@@ -459,13 +477,11 @@ def get_recommendations_from_gemini(topic):
     Ensure all links are real and active. Include only highly-rated and current resources."""
 
     try:
-        response = model.generate_content(prompt)
-        json_str = response.text.strip()
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0]
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].split('```')[0]
-        return json.loads(json_str)
+        return llm_cache.generate(
+            model, prompt, "recommendations", topic,
+            task_type="recommendations", generation_config=GENERATION_CONFIG,
+            parse=parse_json_response
+        )
     except Exception as e:
         st.error(f"Error getting recommendations: {str(e)}")
         return None
@@ -559,7 +575,7 @@ if app_mode == "Learning Assistant":
                 with st.spinner("Creating quiz..."):
                     st.session_state.quiz_answers = {}  # Reset answers
                     st.session_state.quiz_results = {}  # Reset results
-                    quiz = generate_quiz(st.session_state.full_text)
+                    quiz = generate_quiz(st.session_state.full_text, bypass_cache=True)
                     if quiz:
                         st.session_state.quiz_data = quiz
                         display_quiz(quiz)
@@ -572,7 +588,7 @@ if app_mode == "Learning Assistant":
         with tab4:
             st.subheader("Video Transcript")
             if st.session_state.transcript:
-                df = pd.DataFrame(st.session_state.transcript)
+                df = pd.DataFrame(st.session_state.transcript.to_columnar())
                 df['start'] = df['start'].apply(lambda x: time.strftime('%H:%M:%S', time.gmtime(x)))
                 st.dataframe(df[['start', 'text']], use_container_width=True)
     
@@ -5,10 +5,30 @@ import json
 from PIL import Image
 import os
 import sys
+from llm_cache import LLMCache
 
 # Configure Gemini
 genai.configure(api_key="********************************")
 
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+@st.cache_resource
+def get_llm_cache():
+    """Gemini response cache shared across reruns and with api.py"""
+    return LLMCache(os.path.join(os.environ.get("CACHE_DIR", "cache"), "llm_cache.db"))
+
+def parse_flow_response(text):
+    """Parse the JSON flow out of a model response"""
+    json_str = text.strip()
+    if 'json' in json_str:
+        json_str = json_str.split('json')[1].split('```')[0]
+    return json.loads(json_str)
+
 def check_graphviz():
     """Check if Graphviz is installed and accessible"""
     if sys.platform == "win32":
@@ -65,20 +85,15 @@ Make the flow practical, actionable, and comprehensive."""
 
     model = genai.GenerativeModel(
         model_name="gemini-1.5-pro",
-        generation_config={
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192,
-        }
+        generation_config=GENERATION_CONFIG
     )
 
     try:
-        response = model.generate_content(prompt)
-        json_str = response.text.strip()
-        if 'json' in json_str:
-            json_str = json_str.split('json')[1].split('```')[0]
-        return json.loads(json_str)
+        return get_llm_cache().generate(
+            model, prompt, "learning_path", [topic, objective],
+            task_type="learning_path", generation_config=GENERATION_CONFIG,
+            parse=parse_flow_response
+        )
     except Exception as e:
         st.error(f"Error generating content: {str(e)}")
         return None
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import graphviz
+
+FORMATS = ("png", "svg")
+
+
+def graph_key(flow_data, viz_type):
+    """Hash of everything that affects the rendered image"""
+    structure = {
+        "viz_type": viz_type,
+        "nodes": [[str(node["id"]), node["label"]] for node in flow_data["nodes"]],
+        "edges": [[str(edge["from"]), str(edge["to"])] for edge in flow_data.get("edges", [])],
+    }
+    encoded = json.dumps(structure, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def build_source(flow_data, viz_type):
+    """DOT source for a learning path flow"""
+    dot = graphviz.Digraph(
+        comment='Flow Visualization',
+        graph_attr={
+            'rankdir': 'LR' if viz_type == "digraph" else 'TB',
+            'splines': 'ortho',
+            'nodesep': '0.8',
+            'ranksep': '1.0',
+            'fontname': 'Arial',
+            'fontsize': '12'
+        }
+    )
+
+    # Add nodes
+    for node in flow_data["nodes"]:
+        dot.node(str(node['id']), node['label'])
+
+    # Add edges
+    for edge in flow_data.get("edges", []):
+        dot.edge(str(edge['from']), str(edge['to']))
+
+    return dot.source
+
+
+def render_to_file(source, fmt, path, timeout):
+    """Run `dot` on `source` and write the image to `path` atomically
+
+    Runs inside a pool process; the `dot` subprocess is killed if it takes
+    longer than `timeout` seconds.
+    """
+    result = subprocess.run(
+        ["dot", f"-T{fmt}"],
+        input=source.encode("utf-8"),
+        capture_output=True,
+        timeout=timeout,
+        check=True
+    )
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(result.stdout)
+    os.replace(tmp_path, path)
+
+
+class GraphRenderer:
+    """Renders flow graphs off the event loop into a content-addressed directory
+
+    Images are named after `graph_key`, so a repeat render of the same graph
+    is a file-existence check, concurrent requests for the same graph share
+    one render, and different users never overwrite each other's images.
+    """
+
+    def __init__(self, directory, workers=2, timeout=10):
+        self.directory = directory
+        self.workers = workers
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+
+        self._pool = None
+        self._inflight = {}
+
+        self.hits = 0
+        self.renders = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    async def render(self, flow_data, viz_type="digraph", fmt="png"):
+        """Return the file name of the rendered image, rendering it if needed"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported image format: {fmt}")
+
+        filename = f"{graph_key(flow_data, viz_type)}.{fmt}"
+        if os.path.exists(self.path(filename)):
+            self.hits += 1
+            return filename
+
+        task = self._inflight.get(filename)
+        if task is None:
+            task = asyncio.ensure_future(self._render(build_source(flow_data, viz_type), fmt, filename))
+            self._inflight[filename] = task
+            task.add_done_callback(lambda _: self._inflight.pop(filename, None))
+        else:
+            self.hits += 1
+        await asyncio.shield(task)
+        return filename
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "renders": self.renders,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "in_flight": len(self._inflight),
+        }
+
+    async def _render(self, source, fmt, filename):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        self.renders += 1
+        loop = asyncio.get_running_loop()
+        try:
+            # The timeout applies to `dot` alone, inside the pool process, so
+            # time spent queued behind other renders never counts against it
+            await loop.run_in_executor(
+                self._pool, render_to_file, source, fmt, self.path(filename), self.timeout
+            )
+        except subprocess.TimeoutExpired:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.failures += 1
+            raise
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("jobs")
+
+TERMINAL_STATES = ("done", "failed")
+
+
+class JobStore:
+    """SQLite-backed job state so results survive restarts and are visible to every worker
+
+    Every unfinished job has an owner (a worker id) that refreshes the job's
+    heartbeat while it holds it. Ownership changes only through `claim`, a
+    single conditional UPDATE, so of several workers racing for an orphaned
+    job exactly one gets it, and state changes by a worker that lost a job
+    are ignored.
+    """
+
+    def __init__(self, path, retention_seconds=24 * 3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    def create(self, kind, params, owner):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, params, status, created_at, owner, heartbeat_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(params), now, owner, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim(self, owner, stale_before):
+        """Take over unfinished jobs whose heartbeat is older than `stale_before`; returns [(job_id, kind, params)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, kind, params, heartbeat_at FROM jobs WHERE status IN ('queued', 'running') "
+                "AND (heartbeat_at IS NULL OR heartbeat_at < ?) ORDER BY created_at",
+                (stale_before,)
+            ).fetchall()
+            claimed = []
+            for job_id, kind, params, heartbeat_at in rows:
+                # Succeeds only if no other worker claimed or refreshed the job since the SELECT
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = ?, heartbeat_at = ? "
+                    "WHERE job_id = ? AND status IN ('queued', 'running') AND heartbeat_at IS ?",
+                    (owner, time.time(), job_id, heartbeat_at)
+                )
+                self._conn.commit()
+                if cursor.rowcount == 1:
+                    claimed.append((job_id, kind, json.loads(params)))
+        return claimed
+
+    def heartbeat(self, owner):
+        """Refresh the heartbeat of every unfinished job `owner` holds"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time(), owner)
+            )
+            self._conn.commit()
+
+    def mark_running(self, job_id, owner):
+        """Returns False if another worker has taken the job over"""
+        return self._update(
+            job_id, owner, "UPDATE jobs SET status = 'running', started_at = ?", time.time()
+        )
+
+    def mark_done(self, job_id, owner, result):
+        return self._update(
+            job_id, owner, "UPDATE jobs SET status = 'done', result = ?, finished_at = ?",
+            json.dumps(result), time.time()
+        )
+
+    def mark_failed(self, job_id, owner, error):
+        return self._update(
+            job_id, owner, "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?",
+            error, time.time()
+        )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, kind, params, status, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "params": json.loads(row[2]),
+            "status": row[3],
+            "result": json.loads(row[4]) if row[4] is not None else None,
+            "error": row[5],
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+        }
+
+    def purge(self):
+        """Delete finished jobs older than the retention window"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - self.retention_seconds,)
+            )
+            self._conn.commit()
+
+    def _update(self, job_id, owner, sql, *values):
+        with self._lock:
+            cursor = self._conn.execute(
+                sql + " WHERE job_id = ? AND owner = ? AND status IN ('queued', 'running')",
+                (*values, job_id, owner)
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+
+class JobRunner:
+    """Runs registered async handlers as background jobs with bounded concurrency
+
+    `handlers` maps a job kind to an async function taking the job params as
+    keyword arguments. Results must be JSON-serialisable.
+
+    Each runner is a worker with its own id. It heartbeats the jobs it holds
+    every `heartbeat_seconds` and, on the same tick, claims jobs whose
+    heartbeat is older than `lease_seconds`: those of a worker that crashed
+    or was restarted. Any number of workers can share one store, and each
+    interrupted job is resumed by exactly one of them.
+    """
+
+    def __init__(self, store, handlers, workers=4, poll_interval=1.0, heartbeat_seconds=10.0, lease_seconds=None):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds or heartbeat_seconds * 3
+        self.worker_id = uuid.uuid4().hex[:12]
+
+        self._slots = None
+        self._events = {}
+        self._tasks = set()
+        self._heartbeat_task = None
+
+    def submit(self, kind, params):
+        """Persist a new job and start it in the background; returns the job id"""
+        self.store.purge()
+        job_id = self.store.create(kind, params, self.worker_id)
+        self._start(job_id, kind, params)
+        return job_id
+
+    def start(self):
+        """Resume orphaned jobs now and keep heartbeating and claiming in the background"""
+        self.recover()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    def recover(self):
+        """Claim and start jobs whose owner stopped heartbeating"""
+        for job_id, kind, params in self.store.claim(self.worker_id, time.time() - self.lease_seconds):
+            self._start(job_id, kind, params)
+
+    async def wait(self, job_id, timeout):
+        """Return the job once it has finished or `timeout` seconds have passed
+
+        Jobs started by this process wake the waiter immediately; jobs owned by
+        another worker are picked up by re-reading the store every
+        `poll_interval` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in TERMINAL_STATES or remaining <= 0:
+                return job
+
+            event = self._events.get(job_id)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+                else:
+                    await asyncio.sleep(min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    def _start(self, job_id, kind, params):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self._events[job_id] = asyncio.Event()
+        task = asyncio.create_task(self._run(job_id, kind, params))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id, kind, params):
+        try:
+            async with self._slots:
+                if not self.store.mark_running(job_id, self.worker_id):
+                    # Another worker claimed it while this one was unresponsive
+                    return
+                try:
+                    result = await self.handlers[kind](**params)
+                    self.store.mark_done(job_id, self.worker_id, result)
+                except Exception as e:
+                    self.store.mark_failed(job_id, self.worker_id, getattr(e, "detail", None) or str(e))
+        finally:
+            self._events.pop(job_id).set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                self.store.heartbeat(self.worker_id)
+                self.recover()
+            except Exception:
+                logger.exception("Job heartbeat failed")
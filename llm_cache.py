@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Default time-to-live in seconds per task type
+DEFAULT_TTLS = {
+    "summary": 30 * 24 * 3600,
+    "notes": 30 * 24 * 3600,
+    "qa": 7 * 24 * 3600,
+    "quiz": 24 * 3600,
+    "learning_path": 7 * 24 * 3600,
+    "recommendations": 7 * 24 * 3600,
+    "general": 24 * 3600,
+}
+
+
+def content_hash(content):
+    """Stable sha256 of the values inserted into a prompt template"""
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def make_key(template_id, content, generation_config=None, model_name=None, prompt=None):
+    """Build a cache key from the template id, inserted content, rendered prompt and generation config
+
+    Hashing the rendered prompt means an edited template never serves
+    answers cached for its previous wording.
+    """
+    config = json.dumps(
+        {"model": model_name, "config": generation_config or {}},
+        sort_keys=True,
+        default=str
+    )
+    parts = f"{template_id}\x00{content_hash(content)}\x00{config}"
+    if prompt is not None:
+        parts += f"\x00{content_hash(prompt)}"
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Two-tier cache for Gemini responses
+
+    An in-memory LRU sits in front of a SQLite table that survives restarts and
+    is shared by every app in this repo that points at the same file. Entries
+    expire per task type (see DEFAULT_TTLS). If given, `on_generate` is called
+    as `on_generate(task_type, prompt, text, response, seconds)` after every
+    real model call, for latency and token accounting.
+    """
+
+    def __init__(self, path, max_entries=1024, ttls=None, on_generate=None):
+        self.path = path
+        self.on_generate = on_generate
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                task_type TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.by_task = {}
+
+    # ----- public API -----
+
+    def generate(self, model, prompt, template_id, content, task_type="general",
+                 generation_config=None, bypass=False, parse=None):
+        """Return the model response for `prompt`, serving it from cache when possible
+
+        `content` is whatever was inserted into the template; it and the
+        rendered `prompt` feed the key. With `bypass=True` the cache is not read but the fresh response is
+        still stored. If `parse` is given it is applied to the text and the
+        response is only cached when parsing succeeds.
+        """
+        key = self.key_for(model, template_id, content, generation_config, prompt)
+
+        if bypass:
+            self._count(task_type, "bypasses")
+        else:
+            text = self.get(key, task_type)
+            if text is not None:
+                return parse(text) if parse else text
+
+        started = time.perf_counter()
+        if generation_config is not None:
+            response = model.generate_content(prompt, generation_config=generation_config)
+        else:
+            response = model.generate_content(prompt)
+        text = response.text
+        if self.on_generate:
+            self.on_generate(task_type, prompt, text, response, time.perf_counter() - started)
+
+        result = parse(text) if parse else text
+        self.put(key, text, task_type)
+        return result
+
+    def stream(self, model, prompt, template_id, content, task_type="general",
+               generation_config=None, bypass=False):
+        """Yield the response text in pieces as Gemini streams it
+
+        A cache hit yields the whole cached text at once. The joined text is
+        only cached once the stream has been consumed to the end.
+        """
+        key = self.key_for(model, template_id, content, generation_config, prompt)
+
+        if bypass:
+            self._count(task_type, "bypasses")
+        else:
+            text = self.get(key, task_type)
+            if text is not None:
+                yield text
+                return
+
+        kwargs = {"stream": True}
+        if generation_config is not None:
+            kwargs["generation_config"] = generation_config
+        started = time.perf_counter()
+        response = model.generate_content(prompt, **kwargs)
+
+        parts = []
+        for chunk in response:
+            parts.append(chunk.text)
+            yield chunk.text
+        text = "".join(parts)
+        if self.on_generate:
+            self.on_generate(task_type, prompt, text, response, time.perf_counter() - started)
+        self.put(key, text, task_type)
+
+    def key_for(self, model, template_id, content, generation_config=None, prompt=None):
+        return make_key(template_id, content, generation_config, getattr(model, "model_name", None), prompt)
+
+    def get(self, key, task_type="general"):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                text, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count(task_type, "memory_hits")
+                    return text
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT text, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self._count(task_type, "disk_hits")
+                return row[0]
+
+            self._count(task_type, "misses")
+            return None
+
+    def put(self, key, text, task_type="general"):
+        now = time.time()
+        expires_at = now + self.ttls.get(task_type, self.ttls["general"])
+        with self._lock:
+            self._remember(key, text, expires_at)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, task_type, text, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, task_type, text, now, expires_at)
+            )
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit-rate metrics overall and per task type"""
+        def ratio(counters):
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            lookups = hits + counters["misses"]
+            return hits / lookups if lookups else 0.0
+
+        totals = {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+        }
+        return {
+            **totals,
+            "hit_ratio": ratio(totals),
+            "memory_entries": len(self._memory),
+            "by_task": {
+                task: {**counters, "hit_ratio": ratio(counters)}
+                for task, counters in self.by_task.items()
+            },
+        }
+
+    # ----- internals -----
+
+    def _remember(self, key, text, expires_at):
+        self._memory[key] = (text, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _count(self, task_type, counter):
+        setattr(self, counter, getattr(self, counter) + 1)
+        task = self.by_task.setdefault(
+            task_type, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypasses": 0}
+        )
+        task[counter] += 1
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LLMExecutor:
+    """Bounded thread-pool offload for blocking Gemini calls
+
+    `google.generativeai` only exposes a synchronous `generate_content`, so
+    calls are pushed onto a dedicated pool while the event loop keeps serving
+    other requests. A semaphore caps how many calls run at once; callers over
+    the limit wait in the queue and are counted in the queue-depth metrics.
+    """
+
+    def __init__(self, max_concurrency=8):
+        self.max_concurrency = max_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._semaphore = None
+
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _acquire(self):
+        """Wait for a concurrency slot, tracking queue depth and wait time"""
+        semaphore = self._get_semaphore()
+        enqueued_at = time.perf_counter()
+        if semaphore.locked():
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+            try:
+                await semaphore.acquire()
+            finally:
+                self.queued -= 1
+        else:
+            await semaphore.acquire()
+
+        started_at = time.perf_counter()
+        self.total_wait += started_at - enqueued_at
+        self.in_flight += 1
+        return started_at
+
+    def _release(self, started_at, failed):
+        self.in_flight -= 1
+        self.total_run += time.perf_counter() - started_at
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._get_semaphore().release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the LLM pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        started_at = await self._acquire()
+        failed = True
+        try:
+            result = await loop.run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+            failed = False
+            return result
+        finally:
+            self._release(started_at, failed)
+
+    async def stream(self, fn, *args, **kwargs):
+        """Iterate the blocking generator `fn(*args, **kwargs)` on the LLM pool
+
+        Items are handed to the event loop as soon as the worker thread produces
+        them. If the consumer stops early (e.g. the client disconnected) the
+        worker stops pulling from the generator at the next item.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        cancelled = threading.Event()
+
+        def pump():
+            try:
+                for item in fn(*args, **kwargs):
+                    if cancelled.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, e))
+
+        started_at = await self._acquire()
+        failed = True
+        try:
+            loop.run_in_executor(self._pool, pump)
+            while True:
+                item, error = await queue.get()
+                if item is finished:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+            failed = False
+        finally:
+            cancelled.set()
+            self._release(started_at, failed)
+
+    def limited(self, slots):
+        """A view of this executor that also holds one of `slots` (a semaphore) during each call"""
+        return LimitedLLMExecutor(self, slots)
+
+    def stats(self):
+        """Return concurrency and queue-depth metrics"""
+        finished = self.completed + self.failed
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_seconds": self.total_wait / finished if finished else 0.0,
+            "avg_run_seconds": self.total_run / finished if finished else 0.0,
+        }
+
+
+class LimitedLLMExecutor:
+    """LLMExecutor view for one class of callers, e.g. batch jobs
+
+    Every call takes one of `slots` before it queues for the shared pool, so
+    those callers never hold more pool slots than `slots` allows, however many
+    calls each of their tasks fans out into.
+    """
+
+    def __init__(self, executor, slots):
+        self.executor = executor
+        self.slots = slots
+
+    async def run(self, fn, *args, **kwargs):
+        async with self.slots:
+            return await self.executor.run(fn, *args, **kwargs)
+
+    async def stream(self, fn, *args, **kwargs):
+        async with self.slots:
+            async for item in self.executor.stream(fn, *args, **kwargs):
+                yield item
+
+
+class TieredLLMExecutor:
+    """One LLMExecutor per model tier
+
+    Governor admission blocks a pool thread, so with one shared pool the
+    calls queued for a throttled tier would hold every thread and calls for
+    the other tier would wait behind them. `choose(task_type, text)` predicts
+    the tier a call will be routed to, and `tier(task_type, text)` returns
+    that tier's executor; only a validation fallback to a larger tier still
+    waits on another tier's governor from the first tier's thread.
+    """
+
+    def __init__(self, executors, choose):
+        self.executors = executors
+        self.choose = choose
+
+    def tier(self, task_type, text):
+        """Executor for a `task_type` call whose main input is `text`"""
+        return self.executors[self.choose(task_type, text)]
+
+    def limited(self, slots):
+        """A view whose calls on every tier also hold one of `slots`"""
+        return TieredLLMExecutor(
+            {name: executor.limited(slots) for name, executor in self.executors.items()}, self.choose
+        )
+
+    def stats(self):
+        """Metrics summed over the tiers, plus each tier's own"""
+        tiers = {name: executor.stats() for name, executor in self.executors.items()}
+        executors = self.executors.values()
+        finished = sum(e.completed + e.failed for e in executors)
+        return {
+            "max_concurrency": sum(e.max_concurrency for e in executors),
+            "in_flight": sum(e.in_flight for e in executors),
+            "queue_depth": sum(e.queued for e in executors),
+            "max_queue_depth": max(e.max_queue_depth for e in executors),
+            "completed": sum(e.completed for e in executors),
+            "failed": sum(e.failed for e in executors),
+            "avg_wait_seconds": sum(e.total_wait for e in executors) / finished if finished else 0.0,
+            "avg_run_seconds": sum(e.total_run for e in executors) / finished if finished else 0.0,
+            "tiers": tiers,
+        }
@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+from collections import deque
+
+# HTTP status codes worth retrying
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+# Codes that mean the API is overloaded and shrink the concurrency limit:
+# quota exhausted and deadline exceeded
+OVERLOAD_CODES = {429, 504}
+
+
+class LLMUnavailableError(Exception):
+    """Raised when a call is rejected by the circuit breaker or runs out of time"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def error_code(error):
+    """HTTP status of a google.api_core error (or anything with a numeric `code`)"""
+    code = getattr(error, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGovernor:
+    """Client-side flow control for calls to a rate-limited model API
+
+    - Concurrency is capped by an AIMD limit: it grows by about one slot per
+      limit's worth of successes and halves on a 429 or a deadline timeout
+      (504), at most once per `decrease_interval`. Slow successes do not
+      count against it: how long a call takes depends on its output size and
+      tier, and a minute-long large-tier answer is normal.
+    - Callers wait in FIFO order for a slot, so a freed slot goes to the
+      longest waiter instead of whichever thread wakes first.
+    - Retryable errors are retried with full-jitter exponential backoff as
+      long as the retry still fits inside the call's deadline.
+    - After `failure_threshold` consecutive failed attempts the circuit opens
+      and calls fail fast for `open_seconds`; then a single probe call decides
+      whether it closes again.
+
+    Calls are blocking, meant to run on worker threads (see LLMExecutor).
+    """
+
+    def __init__(self, max_limit=8, min_limit=1, initial_limit=None, deadline=90.0, base_backoff=0.5, max_backoff=20.0,
+                 failure_threshold=5, open_seconds=30.0, decrease_interval=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit or max_limit)
+        self.deadline = deadline
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.decrease_interval = decrease_interval
+
+        self._cond = threading.Condition()
+        self._waiters = deque()
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._consecutive_failures = 0
+
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+
+    # ----- public API -----
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        """Run `fn(*args, **kwargs)` under the limit, retrying retryable errors"""
+        result, release = self.call_holding(fn, *args, deadline=deadline, **kwargs)
+        release()
+        return result
+
+    def call_holding(self, fn, *args, deadline=None, **kwargs):
+        """Like `call`, but keep the slot until the returned `release(error=None)` is called
+
+        Used for streaming responses, which occupy the API until read to the end.
+        """
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        with self._cond:
+            self.calls += 1
+
+        while True:
+            self._admit(deadline_at)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                code = error_code(e)
+                self._release(code=code, failed=True)
+                if code not in RETRYABLE_CODES:
+                    raise
+
+                delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+                if time.monotonic() + delay >= deadline_at:
+                    raise LLMUnavailableError(
+                        f"Model unavailable after {attempt + 1} attempts: {e}", retry_after=max(delay, 1.0)
+                    ) from e
+                attempt += 1
+                with self._cond:
+                    self.retries += 1
+                time.sleep(delay)
+                continue
+
+            released = []
+
+            def release(error=None):
+                if not released:
+                    released.append(True)
+                    code = error_code(error) if error is not None else None
+                    self._release(code=code, failed=error is not None)
+
+            return result, release
+
+    def stats(self):
+        with self._cond:
+            return {
+                "state": self._current_state(),
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "circuit_opens": self.circuit_opens,
+            }
+
+    # ----- internals -----
+
+    def _current_state(self):
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = "half_open"
+        return self.state
+
+    def _reject_if_open(self):
+        state = self._current_state()
+        if state == "open" or (state == "half_open" and self._probing):
+            self.rejected += 1
+            retry_after = max(self.open_seconds - (time.monotonic() - self._opened_at), 1.0)
+            raise LLMUnavailableError("Model circuit breaker is open", retry_after=retry_after)
+
+    def _admit(self, deadline_at):
+        with self._cond:
+            self._reject_if_open()
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket or self._in_flight >= int(self.limit):
+                    remaining = deadline_at - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise LLMUnavailableError("Timed out waiting for a model slot")
+                    self._cond.wait(remaining)
+                self._reject_if_open()
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may be admissible too
+                self._cond.notify_all()
+
+            if self.state == "half_open":
+                self._probing = True
+            self._in_flight += 1
+
+    def _release(self, code=None, failed=False):
+        with self._cond:
+            self._in_flight -= 1
+            self._probing = False
+            now = time.monotonic()
+
+            if failed and code in RETRYABLE_CODES:
+                self.failures += 1
+                self._consecutive_failures += 1
+                if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                    if self.state != "open":
+                        self.circuit_opens += 1
+                    self.state = "open"
+                    self._opened_at = now
+            elif not failed:
+                self._consecutive_failures = 0
+                if self.state == "half_open":
+                    self.state = "closed"
+
+            if code in OVERLOAD_CODES:
+                self.throttled += 1
+                # Multiplicative decrease, once per interval so one burst of 429s halves only once
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            elif not failed:
+                # Additive increase: about +1 after `limit` successful calls
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._cond.notify_all()
+
+
+class _GovernedStream:
+    """Streaming response that holds its governor slot until fully consumed"""
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        except Exception as e:
+            self._release(e)
+            raise
+        finally:
+            self._release()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class GovernedModel:
+    """Drop-in wrapper for a GenerativeModel that routes generate_content through an LLMGovernor"""
+
+    def __init__(self, model, governor):
+        self._model = model
+        self.governor = governor
+
+    def generate_content(self, *args, **kwargs):
+        if kwargs.get("stream"):
+            response, release = self.governor.call_holding(self._model.generate_content, *args, **kwargs)
+            return _GovernedStream(response, release)
+        return self.governor.call(self._model.generate_content, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
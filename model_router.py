@@ -0,0 +1,223 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from summarizer import estimate_tokens
+
+logger = logging.getLogger("model_router")
+
+# Output token budget per task type; generous enough that normal answers are
+# never cut off, small enough that a runaway generation stops early
+DEFAULT_OUTPUT_BUDGETS = {
+    "summary": 2048,
+    "summary_chunk": 1024,
+    "summary_reduce": 2048,
+    "notes": 4096,
+    "qa": 1024,
+    "quiz": 4096,
+    "learning_path": 4096,
+    "recommendations": 2048,
+    "general": 8192,
+}
+
+# Seconds a task should take at most; a task routed to the large tier falls
+# back to the fast tier while the large tier's observed latency exceeds this.
+# A full 4096-token answer from the large tier takes about a minute.
+DEFAULT_LATENCY_TARGETS = {
+    "qa": 10.0,
+    "quiz": 60.0,
+    "learning_path": 90.0,
+}
+
+# Smoothing factor of the per-task, per-tier latency average
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class ModelRouter:
+    """Chooses a Gemini tier and output budget per call
+
+    `tiers` maps tier names to models, ordered from fastest to largest. A call
+    goes to the largest tier if its input exceeds `small_input_tokens`, or if
+    its task is in `large_tasks` and the large tier currently meets the task's
+    latency target; otherwise it goes to the fastest tier. While a task is
+    held on the fast tier, one call every `probe_seconds` still goes to the
+    large tier, and its latency replaces the stale average, so the task
+    moves back once the large tier is fast enough again.
+
+    `route` returns a model wrapper that logs the decision together with the
+    call's latency when (and only when) the model is actually called, so cache
+    hits are not counted. `run` adds a fallback to the next larger tier when
+    the result fails validation (raises ValueError).
+    """
+
+    def __init__(self, tiers, large_tasks=(), small_input_tokens=8000,
+                 budgets=None, latency_targets=None, history=200, probe_seconds=60.0):
+        self.tiers = dict(tiers)
+        self.order = list(self.tiers)
+        self.large_tasks = set(large_tasks)
+        self.small_input_tokens = small_input_tokens
+        self.budgets = dict(DEFAULT_OUTPUT_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self.latency_targets = dict(DEFAULT_LATENCY_TARGETS)
+        if latency_targets:
+            self.latency_targets.update(latency_targets)
+        self.probe_seconds = probe_seconds
+
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._counts = {}
+        # Task -> monotonic time of the last latency probe of the large tier
+        self._probed_at = {}
+        self._recent = deque(maxlen=history)
+        self.fallbacks = 0
+
+    # ----- public API -----
+
+    def route(self, task_type, prompt, generation_config=None, tier=None):
+        """Return (model, generation_config) for one call of `task_type` with `prompt`"""
+        input_tokens = estimate_tokens(prompt)
+        if tier is None:
+            tier, reason = self._choose(task_type, input_tokens)
+        else:
+            reason = "fallback"
+        budget = self.budgets.get(task_type, self.budgets["general"])
+        config = {**(generation_config or {}), "max_output_tokens": budget}
+        decision = {
+            "task": task_type,
+            "tier": tier,
+            "reason": reason,
+            "input_tokens": input_tokens,
+            "max_output_tokens": budget,
+        }
+        return RoutedModel(self.tiers[tier], self, decision), config
+
+    def run(self, task_type, prompt, call, generation_config=None):
+        """Run `call(model, generation_config)`, retrying on the next larger tier if it raises ValueError"""
+        model, config = self.route(task_type, prompt, generation_config)
+        while True:
+            try:
+                return call(model, config)
+            except ValueError as e:
+                tier = model.decision["tier"]
+                index = self.order.index(tier)
+                if index == len(self.order) - 1:
+                    raise
+                larger = self.order[index + 1]
+                with self._lock:
+                    self.fallbacks += 1
+                logger.warning(json.dumps({
+                    "event": "fallback", "task": task_type, "from": tier, "to": larger, "error": str(e)[:200]
+                }))
+                model, config = self.route(task_type, prompt, generation_config, tier=larger)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "fallbacks": self.fallbacks,
+                "by_task": {
+                    f"{task}/{tier}": {**counts, "avg_latency": round(self._latency.get((task, tier), 0.0), 3)}
+                    for (task, tier), counts in self._counts.items()
+                },
+                "recent": list(self._recent)[-20:],
+            }
+
+    # ----- internals -----
+
+    def predict(self, task_type, text):
+        """Tier `route` will most likely pick for a call whose main input is `text`; records nothing"""
+        fast, large = self.order[0], self.order[-1]
+        if estimate_tokens(text) > self.small_input_tokens:
+            return large
+        if task_type in self.large_tasks:
+            target = self.latency_targets.get(task_type)
+            with self._lock:
+                observed = self._latency.get((task_type, large))
+            if target is not None and observed is not None and observed > target:
+                return fast
+            return large
+        return fast
+
+    def _choose(self, task_type, input_tokens):
+        fast, large = self.order[0], self.order[-1]
+        if input_tokens > self.small_input_tokens:
+            return large, "large_input"
+        if task_type in self.large_tasks:
+            target = self.latency_targets.get(task_type)
+            with self._lock:
+                observed = self._latency.get((task_type, large))
+                if target is not None and observed is not None and observed > target:
+                    now = time.monotonic()
+                    # The clock starts when the task is first held back
+                    if now - self._probed_at.setdefault(task_type, now) < self.probe_seconds:
+                        return fast, "large_tier_over_latency_target"
+                    self._probed_at[task_type] = now
+                    return large, "latency_probe"
+            return large, "large_task"
+        return fast, "small_input"
+
+    def observe(self, decision, seconds, outcome):
+        """Record the latency and outcome of a routed call and log the decision"""
+        key = (decision["task"], decision["tier"])
+        with self._lock:
+            if outcome == "ok":
+                previous = self._latency.get(key)
+                # A probe is the only recent sample of a tier the task was kept off
+                if previous is None or decision["reason"] == "latency_probe":
+                    self._latency[key] = seconds
+                else:
+                    self._latency[key] = previous + LATENCY_EWMA_ALPHA * (seconds - previous)
+            counts = self._counts.setdefault(key, {"calls": 0, "errors": 0})
+            counts["calls"] += 1
+            if outcome != "ok":
+                counts["errors"] += 1
+            entry = {**decision, "seconds": round(seconds, 3), "outcome": outcome}
+            self._recent.append(entry)
+        logger.info(json.dumps({"event": "route", **entry}))
+
+
+class RoutedModel:
+    """A tier's model bound to one routing decision; times the call and reports it to the router"""
+
+    def __init__(self, model, router, decision):
+        self._model = model
+        self._router = router
+        self.decision = decision
+
+    def generate_content(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self._model.generate_content(*args, **kwargs)
+        except Exception:
+            self._router.observe(self.decision, time.perf_counter() - started, "error")
+            raise
+        if kwargs.get("stream"):
+            return _TimedStream(response, self._router, self.decision, started)
+        self._router.observe(self.decision, time.perf_counter() - started, "ok")
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class _TimedStream:
+    """Streaming response that reports its latency once it has been read to the end"""
+
+    def __init__(self, response, router, decision, started):
+        self._response = response
+        self._router = router
+        self._decision = decision
+        self._started = started
+
+    def __iter__(self):
+        outcome = "error"
+        try:
+            yield from self._response
+            outcome = "ok"
+        finally:
+            self._router.observe(self._decision, time.perf_counter() - self._started, outcome)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def question_id(question):
+    """Stable id for a question, insensitive to case and whitespace"""
+    text = re.sub(r"\s+", " ", question.get("question", "")).strip().lower()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class QuizBank:
+    """Per-video pool of generated quiz questions served as random, non-repeating sets
+
+    The first request for a video generates `batch_size` questions; later
+    requests deal sets from a shuffled deck in memory. Each deck (per video and
+    optional session) only repeats a question once every question has been
+    dealt. When a deck has fewer than `low_water` undealt questions and the pool
+    is below `max_size`, more questions are generated in the background.
+
+    `fill` is an async callable `fill(video_id, existing_questions, count,
+    difficulty, question_type)` returning a list of question dicts; the
+    last two are None unless a filtered draw found no matching questions.
+    Questions are stored in SQLite so the pool survives restarts and is
+    shared by every worker.
+    """
+
+    def __init__(self, path, fill, set_size=5, batch_size=15, max_size=60, low_water=5, max_decks=10000):
+        self.path = path
+        self.fill = fill
+        self.set_size = set_size
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.low_water = low_water
+        self.max_decks = max_decks
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                video_id TEXT NOT NULL,
+                question_id TEXT NOT NULL,
+                type TEXT,
+                difficulty TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (video_id, question_id)
+            )
+        """)
+        self._conn.commit()
+
+        self._pools = {}
+        self._decks = OrderedDict()
+        self._filling = {}
+
+        self.draws = 0
+        self.initial_fills = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.deduplicated = 0
+
+    # ----- public API -----
+
+    async def draw(self, video_id, size=None, session=None, difficulty=None, question_type=None):
+        """Deal `size` questions for `video_id`, generating the pool on first use"""
+        size = size or self.set_size
+        pool = self._pool(video_id)
+        if not pool:
+            self.initial_fills += 1
+            await self._fill(video_id)
+            pool = self._pool(video_id)
+
+        deck = self._deck(video_id, session, pool)
+        picked = self._deal(deck, pool, size, difficulty, question_type)
+        filtered = difficulty is not None or question_type is not None
+        if not picked and filtered and len(pool) < self.max_size:
+            # Nothing in the pool matches: generate questions that do
+            self.refills += 1
+            await self._fill(video_id, difficulty, question_type)
+            deck = self._deck(video_id, session, pool)
+            picked = self._deal(deck, pool, size, difficulty, question_type)
+        self.draws += 1
+
+        if len(pool) < self.max_size:
+            if filtered and len(picked) < size:
+                self.schedule_refill(video_id, difficulty, question_type)
+            elif len(deck["order"]) - deck["position"] < self.low_water:
+                self.schedule_refill(video_id)
+        return [pool[qid] for qid in picked]
+
+    async def refill(self, video_id):
+        """Generate another batch of questions now and wait for it"""
+        self.refills += 1
+        await self._fill(video_id)
+
+    def schedule_refill(self, video_id, difficulty=None, question_type=None):
+        """Generate another batch in the background unless one is already running"""
+        if (video_id, difficulty, question_type) in self._filling:
+            return
+        self.refills += 1
+        self._fill_task(video_id, difficulty, question_type).add_done_callback(self._background_done)
+
+    async def ensure(self, video_id):
+        """Generate the initial pool for `video_id` if it has none (for pre-warming)"""
+        if not self._pool(video_id):
+            self.initial_fills += 1
+            await self._fill(video_id)
+        return len(self._pool(video_id))
+
+    def size(self, video_id):
+        return len(self._pool(video_id))
+
+    def stats(self):
+        with self._lock:
+            videos, questions = self._conn.execute(
+                "SELECT COUNT(DISTINCT video_id), COUNT(*) FROM questions"
+            ).fetchone()
+        return {
+            "videos": videos,
+            "questions": questions,
+            "draws": self.draws,
+            "initial_fills": self.initial_fills,
+            "refills": self.refills,
+            "refill_failures": self.refill_failures,
+            "refills_in_flight": len(self._filling),
+            "deduplicated": self.deduplicated,
+            "decks": len(self._decks),
+        }
+
+    # ----- internals -----
+
+    def _pool(self, video_id):
+        pool = self._pools.get(video_id)
+        if pool is None:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT question_id, data FROM questions WHERE video_id = ? ORDER BY created_at",
+                    (video_id,)
+                ).fetchall()
+            pool = self._pools[video_id] = {qid: json.loads(data) for qid, data in rows}
+        return pool
+
+    async def _fill(self, video_id, difficulty=None, question_type=None):
+        if (video_id, difficulty, question_type) in self._filling:
+            # Served by a generation another request already started
+            self.deduplicated += 1
+        await asyncio.shield(self._fill_task(video_id, difficulty, question_type))
+
+    def _fill_task(self, video_id, difficulty, question_type):
+        key = (video_id, difficulty, question_type)
+        task = self._filling.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(video_id, difficulty, question_type))
+            self._filling[key] = task
+            task.add_done_callback(lambda _: self._filling.pop(key, None))
+        return task
+
+    async def _generate(self, video_id, difficulty=None, question_type=None):
+        pool = self._pool(video_id)
+        questions = await self.fill(video_id, list(pool.values()), self.batch_size, difficulty, question_type)
+
+        now = time.time()
+        added = {}
+        for question in questions:
+            qid = question_id(question)
+            if qid not in pool and qid not in added:
+                added[qid] = {**question, "id": qid}
+        if not added:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO questions (video_id, question_id, type, difficulty, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (video_id, qid, q.get("type"), q.get("difficulty"), json.dumps(q), now)
+                    for qid, q in added.items()
+                ]
+            )
+            self._conn.commit()
+        pool.update(added)
+
+    def _background_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.refill_failures += 1
+
+    def _deck(self, video_id, session, pool):
+        key = (video_id, session)
+        deck = self._decks.get(key)
+        if deck is None:
+            order = list(pool)
+            random.shuffle(order)
+            deck = self._decks[key] = {"order": order, "position": 0, "known": len(pool)}
+            while len(self._decks) > self.max_decks:
+                self._decks.popitem(last=False)
+        else:
+            self._decks.move_to_end(key)
+
+        if deck["known"] < len(pool):
+            # Shuffle newly generated questions into the undealt part of the deck
+            dealt = set(deck["order"])
+            undealt = deck["order"][deck["position"]:] + [qid for qid in pool if qid not in dealt]
+            random.shuffle(undealt)
+            deck["order"][deck["position"]:] = undealt
+            deck["known"] = len(pool)
+        return deck
+
+    def _deal(self, deck, pool, size, difficulty, question_type):
+        def matches(qid):
+            question = pool[qid]
+            return ((difficulty is None or question.get("difficulty") == difficulty)
+                    and (question_type is None or question.get("type") == question_type))
+
+        picked = self._take(deck, size, matches)
+        if len(picked) < size and deck["position"] == len(deck["order"]):
+            # Deck exhausted: start a new pass, with what was just dealt at its end
+            dealt = set(picked)
+            order = [qid for qid in pool if qid not in dealt]
+            random.shuffle(order)
+            deck["order"] = order + picked
+            deck["position"] = 0
+            picked += self._take(deck, size - len(picked), lambda qid: qid not in dealt and matches(qid))
+        elif len(picked) < size:
+            # Only the filter ran short: reuse matches dealt earlier in this pass
+            # and leave the deck alone, so unfiltered draws keep their progress
+            dealt = set(picked)
+            earlier = [qid for qid in deck["order"][:deck["position"]] if qid not in dealt and matches(qid)]
+            picked += random.sample(earlier, min(size - len(picked), len(earlier)))
+        return picked
+
+    def _take(self, deck, size, matches):
+        order = deck["order"]
+        picked = []
+        i = deck["position"]
+        while i < len(order) and len(picked) < size:
+            if matches(order[i]):
+                # Swap the match to the front of the undealt part and consume it
+                position = deck["position"]
+                order[position], order[i] = order[i], order[position]
+                picked.append(order[position])
+                deck["position"] += 1
+            i += 1
+        return picked
@@ -0,0 +1,52 @@
+import gzip
+import json
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def select_fields(payload, fields):
+    """Keep only the comma-separated top-level `fields` of `payload` (all when None)"""
+    if not fields:
+        return payload
+    wanted = {field.strip() for field in fields.split(",") if field.strip()}
+    return {key: value for key, value in payload.items() if key in wanted}
+
+
+def dumps(payload):
+    """Serialize to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_response(request, payload, status_code=200):
+    """JSON response compressed with brotli or gzip according to Accept-Encoding"""
+    body = dumps(payload)
+    headers = {"Vary": "Accept-Encoding"}
+
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in request.headers.get("accept-encoding", "").split(",")
+        }
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
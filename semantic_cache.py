@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+STOPWORDS = {
+    "a", "an", "and", "the", "for", "with", "of", "in", "on", "to", "using", "via",
+    "how", "learn", "learning", "intro", "introduction", "basics", "guide",
+}
+
+
+def topic_terms(topic):
+    """Lowercased, stopword-free, crudely singularized terms of a topic"""
+    terms = []
+    for word in re.findall(r"[a-z0-9+#]+", topic.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def normalize_topic(topic):
+    """Order-insensitive canonical form, used for exact matches"""
+    return " ".join(sorted(set(topic_terms(topic))))
+
+
+def _bucket(feature, dims):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % dims
+
+
+class SemanticCache:
+    """Similarity cache for responses keyed by short free-text topics
+
+    Topics are embedded by hashing their terms and term bigrams into `dims`
+    (2^18 by default) buckets, weighted by TF-IDF and L2-normalized. The
+    vectors of all cached topics form a sparse bucket x topic matrix stored
+    CSR-style (ptr, rows, weights), so a lookup only reads the postings of
+    the few buckets the query has weights in and costs a fraction of a
+    millisecond even with 100k topics. New topics are appended to an
+    unsorted tail that is merged into the CSR arrays every `merge_every`
+    entries.
+
+    A lookup is a hit when cosine similarity reaches `threshold` and the
+    candidate shares at least `min_overlap` (Jaccard) of its normalized
+    terms with the query, so a bucket collision alone never serves another
+    topic's value. Entries persist in SQLite and the matrix is rebuilt from
+    them on startup.
+    """
+
+    def __init__(self, path, threshold=0.85, dims=2 ** 18, ttl_seconds=7 * 24 * 3600, min_overlap=0.5,
+                 merge_every=4096):
+        self.path = path
+        self.threshold = threshold
+        self.dims = dims
+        self.ttl_seconds = ttl_seconds
+        self.min_overlap = min_overlap
+        self.merge_every = merge_every
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                normalized TEXT PRIMARY KEY,
+                topic TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+        # Non-zero weights in insertion order: (topic row, bucket, weight)
+        self._entry_rows = np.zeros(4096, dtype=np.int32)
+        self._entry_buckets = np.zeros(4096, dtype=np.int32)
+        self._entry_weights = np.zeros(4096, dtype=np.float32)
+        self._nnz = 0
+        # CSR over buckets of the first `_merged` entries
+        self._ptr = np.zeros(dims + 1, dtype=np.int64)
+        self._csr_rows = np.zeros(0, dtype=np.int32)
+        self._csr_weights = np.zeros(0, dtype=np.float32)
+        self._merged = 0
+
+        self._expires = np.zeros(1024, dtype=np.float64)
+        self._df = np.zeros(dims, dtype=np.float64)
+        self._rows = {}
+        self._normalized = []
+        self._count = 0
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        self._load()
+
+    # ----- public API -----
+
+    def lookup(self, topic):
+        """Return (value, cached_topic, similarity) for the closest live entry, or None"""
+        normalized = normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            row = self._rows.get(normalized)
+            if row is not None and self._expires[row] > now:
+                self.exact_hits += 1
+                return self._fetch(normalized, 1.0)
+
+            buckets, weights = self._embed(normalized)
+            if self._count and len(buckets):
+                scores = self._scores(buckets, weights)
+                scores[self._expires[:self._count] <= now] = -1.0
+                candidates = np.flatnonzero(scores >= self.threshold)
+                terms = set(normalized.split())
+                for best in candidates[np.argsort(-scores[candidates], kind="stable")]:
+                    if self._overlap(terms, set(self._normalized[best].split())) >= self.min_overlap:
+                        self.similar_hits += 1
+                        return self._fetch(self._normalized[best], float(scores[best]))
+
+            self.misses += 1
+            return None
+
+    def put(self, topic, value):
+        normalized = normalize_topic(topic)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (normalized, topic, value, expires_at) VALUES (?, ?, ?, ?)",
+                (normalized, topic, json.dumps(value), expires_at)
+            )
+            self._conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+            self._index(normalized, expires_at)
+
+    def stats(self):
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "topics": self._count,
+            "threshold": self.threshold,
+        }
+
+    # ----- internals -----
+
+    def _features(self, normalized):
+        terms = normalized.split()
+        return terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+
+    def _embed(self, normalized):
+        """Sparse TF-IDF vector as (bucket indexes, unit-length weights)"""
+        counts = {}
+        for feature in self._features(normalized):
+            bucket = _bucket(feature, self.dims)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        if not counts:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+
+        buckets = np.fromiter(counts, dtype=np.intp, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        idf = np.log((1 + self._count) / (1 + self._df[buckets])) + 1
+        weights = tf * idf
+        weights /= np.linalg.norm(weights)
+        return buckets, weights.astype(np.float32)
+
+    def _scores(self, buckets, weights):
+        """Cosine similarity of the query vector with every cached topic"""
+        scores = np.zeros(self._count, dtype=np.float32)
+        ptr, rows, values = self._ptr, self._csr_rows, self._csr_weights
+        for bucket, weight in zip(buckets, weights):
+            lo, hi = ptr[bucket], ptr[bucket + 1]
+            # A topic has each bucket at most once, so the rows are unique
+            scores[rows[lo:hi]] += weight * values[lo:hi]
+
+        tail = slice(self._merged, self._nnz)
+        hit = np.isin(self._entry_buckets[tail], buckets)
+        if hit.any():
+            order = np.argsort(buckets)
+            position = np.searchsorted(buckets[order], self._entry_buckets[tail][hit])
+            np.add.at(
+                scores, self._entry_rows[tail][hit], weights[order][position] * self._entry_weights[tail][hit]
+            )
+        return scores
+
+    @staticmethod
+    def _overlap(a, b):
+        """Jaccard similarity of two term sets"""
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def _index(self, normalized, expires_at):
+        row = self._rows.get(normalized)
+        if row is None:
+            row = self._count
+            if row == len(self._expires):
+                expires = np.zeros(row * 2, dtype=np.float64)
+                expires[:row] = self._expires
+                self._expires = expires
+            self._count += 1
+            self._rows[normalized] = row
+            self._normalized.append(normalized)
+            buckets, _ = self._embed(normalized)
+            self._df[buckets] += 1
+            # Document weights use the IDF at insertion time; queries use the current one
+            buckets, weights = self._embed(normalized)
+            self._append(row, buckets, weights)
+        self._expires[row] = expires_at
+
+    def _append(self, row, buckets, weights):
+        end = self._nnz + len(buckets)
+        if end > len(self._entry_rows):
+            capacity = max(end, len(self._entry_rows) * 2)
+            for name in ("_entry_rows", "_entry_buckets", "_entry_weights"):
+                old = getattr(self, name)
+                grown = np.zeros(capacity, dtype=old.dtype)
+                grown[:self._nnz] = old[:self._nnz]
+                setattr(self, name, grown)
+        self._entry_rows[self._nnz:end] = row
+        self._entry_buckets[self._nnz:end] = buckets
+        self._entry_weights[self._nnz:end] = weights
+        self._nnz = end
+        if self._nnz - self._merged >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        """Rebuild the CSR arrays from all entries"""
+        buckets = self._entry_buckets[:self._nnz]
+        order = np.argsort(buckets, kind="stable")
+        self._ptr = np.zeros(self.dims + 1, dtype=np.int64)
+        self._ptr[1:] = np.cumsum(np.bincount(buckets, minlength=self.dims))
+        self._csr_rows = self._entry_rows[:self._nnz][order]
+        self._csr_weights = self._entry_weights[:self._nnz][order]
+        self._merged = self._nnz
+
+    def _fetch(self, normalized, similarity):
+        row = self._conn.execute(
+            "SELECT topic, value FROM entries WHERE normalized = ?", (normalized,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[1]), row[0], similarity
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT normalized, expires_at FROM entries WHERE expires_at > ?", (time.time(),)
+        ).fetchall()
+        for normalized, expires_at in rows:
+            self._index(normalized, expires_at)
+        self._merge()
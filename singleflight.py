@@ -0,0 +1,55 @@
+import asyncio
+import re
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of free-text inputs used in keys"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one computation
+
+    The first caller for a key starts the work as a separate task; callers
+    arriving while it runs await the same task. The task is shielded, so a
+    disconnecting caller does not cancel the work for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.stats_by_namespace = {}
+
+    async def do(self, key, fn):
+        """Return the result of `fn()` for `key`, sharing it with concurrent callers"""
+        counters = self._counters(key)
+        counters["calls"] += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            counters["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            counters["deduplicated"] += 1
+
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """Calls, executions and deduplicated callers per key namespace"""
+        return {
+            "in_flight": len(self._inflight),
+            "by_namespace": {name: dict(counters) for name, counters in self.stats_by_namespace.items()},
+        }
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def _counters(self, key):
+        namespace = key.split(":", 1)[0]
+        return self.stats_by_namespace.setdefault(
+            namespace, {"calls": 0, "executions": 0, "deduplicated": 0}
+        )
@@ -0,0 +1,340 @@
+import json
+import re
+import threading
+
+from pydantic import TypeAdapter, ValidationError
+
+FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def extract_json_text(text):
+    """Cut the JSON value out of a model response (fences and surrounding prose removed)"""
+    match = FENCE.search(text)
+    if match:
+        text = match.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def repair_json(text):
+    """Best-effort fix-up of near-valid JSON produced by a language model
+
+    Handles comments, trailing commas, Python literals, raw newlines inside
+    strings, text after the top-level value and output truncated mid-value.
+    """
+    out = []
+    stack = []
+    in_string = False
+    escaped = False
+    i = 0
+    n = len(text)
+
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            elif ch == "\t":
+                ch = "\\t"
+            elif ch == "\r":
+                ch = ""
+            out.append(ch)
+            i += 1
+            continue
+
+        if text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            i += 1
+            if not stack:
+                break
+            continue
+        elif ch.isalpha():
+            word = re.match(r"[A-Za-z]+", text[i:]).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        out.append(ch)
+        i += 1
+
+    # Truncated output: close the open string, drop a dangling key or comma,
+    # then close every open container
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    if stack:
+        _drop_dangling(out)
+        while stack:
+            _strip_trailing_comma(out)
+            out.append(stack.pop())
+
+    return "".join(out)
+
+
+def _strip_trailing_comma(out):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j:]
+
+
+def _drop_dangling(out):
+    """Remove a trailing `"key":` or `"key"` that has no value yet"""
+    text = "".join(out).rstrip()
+    match = re.search(r'[,{]\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', text)
+    if match and (text.endswith(":") or _inside_object(text[:match.start() + 1])):
+        text = text[:match.start() + 1].rstrip(",")
+    out[:] = list(text)
+
+
+def _inside_object(prefix):
+    """Whether the innermost open container at the end of `prefix` is an object"""
+    depth = []
+    in_string = False
+    escaped = False
+    for ch in prefix:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth.append(ch)
+        elif ch in "}]" and depth:
+            depth.pop()
+    return bool(depth) and depth[-1] == "{"
+
+
+def parse_json_lenient(text):
+    """Parse model output as JSON, repairing it locally if needed
+
+    Returns (data, repaired) where `repaired` tells whether local repair was
+    required. Raises ValueError if the output cannot be salvaged.
+    """
+    candidate = extract_json_text(text)
+    try:
+        return json.loads(candidate), False
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(candidate)), True
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Unrepairable JSON output: {e}") from e
+
+
+def _get_path(data, path):
+    for part in path:
+        data = data[part]
+    return data
+
+
+def _set_path(data, path, value):
+    for part in path[:-1]:
+        data = data[part]
+    data[path[-1]] = value
+
+
+def _fragment_path(loc, data):
+    """Smallest enclosing list element (or top-level field) of an error location"""
+    path = []
+    best = None
+    node = data
+    for part in loc:
+        if isinstance(node, list) and isinstance(part, int) and part < len(node):
+            best = path + [part]
+        elif isinstance(node, dict) and part in node:
+            pass
+        else:
+            break
+        path.append(part)
+        node = node[part]
+    if best is not None:
+        return tuple(best)
+    return tuple(loc[:1])
+
+
+def _build_fragment_prompt(schema, document, path, fragment, errors):
+    return f"""A JSON document failed validation. Fix ONLY the fragment at path {list(path)}.
+
+        JSON schema of the whole document:
+        {json.dumps(schema)}
+
+        Document (for context):
+        {json.dumps(document)}
+
+        Current fragment:
+        {json.dumps(fragment)}
+
+        Validation errors:
+        {errors}
+
+        Return ONLY the corrected fragment as JSON, with no other text.
+        """
+
+
+class StructuredOutput:
+    """Schema-validated JSON generation with local repair and targeted re-asks
+
+    1. The model is asked for JSON (`response_mime_type`) through the LLM cache.
+    2. The text is parsed, repairing near-valid JSON locally.
+    3. The result is validated against a Pydantic type. Invalid fragments
+       (the smallest enclosing list element, or the failing top-level field)
+       are sent back to the model one by one instead of regenerating the
+       whole document.
+    4. Only if the output cannot be parsed at all is it regenerated in full.
+
+    Repaired results are written back to the cache so later hits are clean.
+    """
+
+    def __init__(self, cache, max_fragment_rounds=2):
+        self.cache = cache
+        self.max_fragment_rounds = max_fragment_rounds
+        self._lock = threading.Lock()
+        self.counters = {
+            "clean": 0,
+            "repaired_locally": 0,
+            "fragment_reasks": 0,
+            "fragments_dropped": 0,
+            "regenerations_avoided": 0,
+            "full_regenerations": 0,
+            "failures": 0,
+        }
+
+    def generate(self, model, prompt, template_id, content, output_type, task_type="general",
+                 generation_config=None, bypass=False):
+        """Return validated data of `output_type` (a Pydantic model or typing construct), dumped to plain JSON types"""
+        adapter = TypeAdapter(output_type)
+        key = self.cache.key_for(model, template_id, content, generation_config, prompt)
+
+        text = self.cache.generate(
+            model, prompt, template_id, content,
+            task_type=task_type, generation_config=generation_config, bypass=bypass
+        )
+        try:
+            data, repaired = parse_json_lenient(text)
+        except ValueError:
+            # Nothing to salvage: regenerate once
+            self._count("full_regenerations")
+            text = self.cache.generate(
+                model, prompt, template_id, content,
+                task_type=task_type, generation_config=generation_config, bypass=True
+            )
+            try:
+                data, repaired = parse_json_lenient(text)
+            except ValueError:
+                self._count("failures")
+                raise
+
+        result, fixed = self._validate_and_fix(model, adapter, data, task_type, generation_config)
+
+        if repaired or fixed:
+            if repaired:
+                self._count("repaired_locally")
+            self._count("regenerations_avoided")
+            # Store the clean version so the next cache hit skips all of this
+            self.cache.put(key, json.dumps(result), task_type)
+        else:
+            self._count("clean")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _validate_and_fix(self, model, adapter, data, task_type, generation_config):
+        fixed = False
+        schema = adapter.json_schema()
+
+        for attempt in range(self.max_fragment_rounds + 1):
+            try:
+                return adapter.dump_python(adapter.validate_python(data), by_alias=True, mode="json"), fixed
+            except ValidationError as e:
+                errors = e.errors()
+
+            if attempt == self.max_fragment_rounds:
+                break
+
+            by_path = {}
+            for error in errors:
+                path = _fragment_path(error["loc"], data)
+                by_path.setdefault(path, []).append(f"{list(error['loc'])}: {error['msg']}")
+
+            for path, messages in by_path.items():
+                try:
+                    fragment = _get_path(data, path) if path else data
+                except (KeyError, IndexError, TypeError):
+                    fragment = None
+                self._count("fragment_reasks")
+                try:
+                    replacement = self.cache.generate(
+                        model,
+                        _build_fragment_prompt(schema, data, path, fragment, "\n".join(messages)),
+                        "repair_fragment", [schema, data, list(path), messages],
+                        task_type=task_type, generation_config=generation_config,
+                        parse=lambda text: parse_json_lenient(text)[0]
+                    )
+                except ValueError:
+                    continue
+                if path:
+                    _set_path(data, path, replacement)
+                else:
+                    data = replacement
+                fixed = True
+
+        # Last resort: drop list elements that are still invalid, if that leaves a usable result
+        data = self._drop_invalid_elements(adapter, data, errors)
+        try:
+            return adapter.dump_python(adapter.validate_python(data), by_alias=True, mode="json"), True
+        except ValidationError:
+            self._count("failures")
+            raise
+
+    def _drop_invalid_elements(self, adapter, data, errors):
+        drops = {}
+        for error in errors:
+            path = _fragment_path(error["loc"], data)
+            if path and isinstance(path[-1], int):
+                drops.setdefault(path[:-1], set()).add(path[-1])
+
+        for parent_path, indexes in drops.items():
+            try:
+                parent = _get_path(data, parent_path) if parent_path else data
+            except (KeyError, IndexError, TypeError):
+                continue
+            if not isinstance(parent, list) or len(indexes) >= len(parent):
+                continue
+            parent[:] = [item for i, item in enumerate(parent) if i not in indexes]
+            self._count("fragments_dropped", len(indexes))
+        return data
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
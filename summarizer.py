@@ -0,0 +1,146 @@
+import asyncio
+import re
+
+# Rough words-per-token ratio for English text with Gemini's tokenizer
+WORDS_PER_TOKEN = 0.75
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate from the word count"""
+    return int(len(text.split()) / WORDS_PER_TOKEN)
+
+
+def split_into_chunks(text, max_tokens):
+    """Split text into chunks of at most `max_tokens`, preferring sentence boundaries"""
+    max_words = max(int(max_tokens * WORDS_PER_TOKEN), 1)
+    chunks = []
+    current = []
+    current_words = 0
+
+    for sentence in SENTENCE_END.split(text):
+        words = sentence.split()
+        # Auto-generated transcripts often have no punctuation at all, so very
+        # long "sentences" are cut on word boundaries
+        while words:
+            room = max_words - current_words
+            if len(words) <= room:
+                current.extend(words)
+                current_words += len(words)
+                break
+            if current_words and len(words) <= max_words:
+                chunks.append(" ".join(current))
+                current, current_words = [], 0
+                continue
+            current.extend(words[:room])
+            chunks.append(" ".join(current))
+            words = words[room:]
+            current, current_words = [], 0
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def build_chunk_prompt(chunk, index, total):
+    return f"""This is part {index + 1} of {total} of a lecture transcript.
+        Summarize this part, keeping every main point, definition and example:
+        {chunk}
+        """
+
+
+def build_reduce_prompt(partials):
+    sections = "\n\n".join(f"Part {i + 1}:\n{p}" for i, p in enumerate(partials))
+    return f"""The following are summaries of consecutive parts of one lecture.
+        Combine them into a single concise summary of the whole lecture:
+        {sections}
+
+        Provide a clear, structured summary that captures the main points and key insights.
+        """
+
+
+class MapReduceSummarizer:
+    """Hierarchical summarization for transcripts too long for one prompt
+
+    The transcript is split into token-budgeted chunks that are summarized
+    concurrently (map), and the partial summaries are combined (reduce). If the
+    partials themselves exceed the budget they are reduced in groups first.
+    Every call goes through the LLM cache, so a retry after a failure only
+    regenerates the chunks that did not complete. `route(template_id, prompt)`
+    returns the (model, generation_config) to use for each call; `executor`
+    runs them, and each method accepts another one (e.g. a limited view) for
+    a single summary. Executors are TieredLLMExecutors.
+    """
+
+    def __init__(self, route, cache, executor, chunk_tokens=6000, max_concurrency=4):
+        self.route = route
+        self.cache = cache
+        self.executor = executor
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+
+    async def _generate_all(self, jobs, bypass, executor):
+        """Run (template_id, prompt, content) jobs concurrently under the concurrency cap"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate(template_id, prompt, content):
+            model, generation_config = self.route(template_id, prompt)
+            async with semaphore:
+                return await executor.tier(template_id, prompt).run(
+                    self.cache.generate, model, prompt, template_id, content,
+                    task_type="summary", generation_config=generation_config, bypass=bypass
+                )
+
+        # Let every job finish so completed chunks are cached even if one fails
+        results = await asyncio.gather(*(generate(*job) for job in jobs), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def map(self, text, bypass=False, executor=None):
+        """Summarize the chunks of `text` and collapse the partials until they fit one reduce prompt"""
+        executor = executor or self.executor
+        chunks = split_into_chunks(text, self.chunk_tokens)
+        partials = await self._generate_all(
+            [("summary_chunk", build_chunk_prompt(chunk, i, len(chunks)), chunk)
+             for i, chunk in enumerate(chunks)],
+            bypass, executor
+        )
+
+        while len(partials) > 1 and estimate_tokens(" ".join(partials)) > self.chunk_tokens:
+            groups = self._group(partials)
+            if len(groups) == len(partials):
+                break
+            partials = await self._generate_all(
+                [("summary_reduce", build_reduce_prompt(group), group) for group in groups],
+                bypass, executor
+            )
+        return partials
+
+    async def summarize(self, text, bypass=False, executor=None):
+        """Map-reduce summary of `text`"""
+        executor = executor or self.executor
+        partials = await self.map(text, bypass, executor)
+        if len(partials) == 1:
+            return partials[0]
+        prompt = build_reduce_prompt(partials)
+        model, generation_config = self.route("summary_reduce", prompt)
+        return await executor.tier("summary_reduce", prompt).run(
+            self.cache.generate, model, prompt, "summary_reduce", partials,
+            task_type="summary", generation_config=generation_config, bypass=bypass
+        )
+
+    def _group(self, partials):
+        """Pack consecutive partial summaries into groups within the chunk budget"""
+        groups = [[]]
+        used = 0
+        for partial in partials:
+            tokens = estimate_tokens(partial)
+            if groups[-1] and used + tokens > self.chunk_tokens:
+                groups.append([])
+                used = 0
+            groups[-1].append(partial)
+            used += tokens
+        return groups
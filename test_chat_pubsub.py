@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("redis.asyncio")
+
+from chat_pubsub import RedisPubSub
+
+
+@pytest.fixture
+def redis_url():
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"redis://{host}:{port}/0"
+    server.shutdown()
+    server.server_close()
+
+
+async def start_hub(url):
+    received = []
+    bus = RedisPubSub(url, flush_interval=0.001)
+    await bus.start(lambda kind, room, data: received.append((kind, room, data)))
+    return bus, received
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_frames_fan_out_across_hubs(redis_url):
+    async def scenario():
+        a, a_received = await start_hub(redis_url)
+        b, b_received = await start_hub(redis_url)
+        try:
+            await a.subscribe("General")
+            await b.subscribe("General")
+
+            a.publish("General", '{"text": "one"}')
+            a.publish("General", '{"text": "two"}')
+            a.publish_presence("General", [[1, "alice", 1]])
+            await wait_for(lambda: len(b_received) == 2)
+
+            assert ("room", "General", ['{"text": "one"}', '{"text": "two"}']) in b_received
+            assert ("presence", "General", [[1, "alice", 1]]) in b_received
+
+            b.publish_control({"type": "room_created", "room": "Lab"})
+            await wait_for(lambda: a_received)
+            assert a_received == [("control", None, {"type": "room_created", "room": "Lab"})]
+
+            await b.unsubscribe("General")
+            a.publish("General", '{"text": "three"}')
+            await asyncio.sleep(0.2)
+            assert len(b_received) == 2
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(scenario())
+
+
+def test_membership_versions_are_shared(redis_url):
+    async def scenario():
+        a, _ = await start_hub(redis_url)
+        b, _ = await start_hub(redis_url)
+        try:
+            version, members, departed = await a.join("General", "c1", "alice")
+            assert (version, list(members.values()), departed) == (1, ["alice"], [])
+
+            version, members, departed = await b.join("General", "c2", "bob")
+            assert version == 2 and sorted(members.values()) == ["alice", "bob"] and departed == []
+
+            assert await a.leave("General", "c1") == 3
+
+            version, members, _ = await b.join("General", "c3", "carol")
+            assert version == 4 and sorted(members.values()) == ["bob", "carol"]
+
+            created, rooms = await a.add_room("Lab")
+            assert created and "Lab" in rooms
+            created, _ = await b.add_room("Lab")
+            assert not created
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(scenario())
+
+
+def test_join_prunes_members_of_dead_workers(redis_url):
+    async def scenario():
+        a, _ = await start_hub(redis_url)
+        b, _ = await start_hub(redis_url)
+        try:
+            await a.join("General", "c1", "alice")
+            await b.join("General", "c2", "bob")
+
+            # Worker a crashes: its heartbeat expires but its members stay behind
+            for task in a._tasks:
+                task.cancel()
+            await b._redis.delete(b._key("worker", a.worker_id))
+
+            version, members, departed = await b.join("General", "c3", "carol")
+            assert sorted(members.values()) == ["bob", "carol"]
+            assert departed == [[version + 1, "alice", -1]]
+            assert await b._redis.get(b._key("version", "General")) == str(version + 1)
+
+            # A member this worker lost track of is dropped too
+            b._local_members["General"].discard(f"{b.worker_id}:c2")
+            version, members, departed = await b.join("General", "c4", "dave")
+            assert sorted(members.values()) == ["carol", "dave"]
+            assert departed == [[version + 1, "bob", -1]]
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+from semantic_cache import SemanticCache
+
+TOPICS = [
+    "german", "excel", "python", "calculus", "chemistry", "biology", "welding", "painting",
+    "guitar", "piano", "algebra", "geometry", "economics", "marketing", "accounting", "physics",
+    "astronomy", "geology", "philosophy", "psychology", "sociology", "history", "literature",
+    "photography", "cooking", "nutrition", "statistics", "javascript", "rust", "kubernetes",
+    "docker", "linux", "networking", "cryptography", "robotics", "electronics", "plumbing",
+    "carpentry", "gardening", "spanish",
+]
+
+
+def test_distinct_single_word_topics_miss(tmp_path):
+    cache = SemanticCache(str(tmp_path / "resources.db"))
+    for topic in TOPICS:
+        cache.put(topic, {"topic": topic})
+
+    for topic in ["anthropology", "french", "sculpture", "trigonometry", "dance", "poetry", "java"]:
+        assert cache.lookup(topic) is None
+
+    value, cached_topic, similarity = cache.lookup("German")
+    assert value == {"topic": "german"} and similarity == 1.0
+
+
+def test_reworded_topic_hits(tmp_path):
+    cache = SemanticCache(str(tmp_path / "resources.db"))
+    for topic in TOPICS:
+        cache.put(topic, {"topic": topic})
+    cache.put("machine learning algorithms with python", {"topic": "ml"})
+
+    value, cached_topic, similarity = cache.lookup("Python machine learning algorithm")
+    assert value == {"topic": "ml"}
+
+
+def test_entries_survive_restart_and_tail_merge(tmp_path):
+    path = str(tmp_path / "resources.db")
+    cache = SemanticCache(path, merge_every=8)
+    for topic in TOPICS:
+        cache.put(f"{topic} fundamentals course", {"topic": topic})
+
+    reopened = SemanticCache(path, merge_every=8)
+    for cache in (cache, reopened):
+        value, cached_topic, similarity = cache.lookup("welding fundamentals courses")
+        assert value == {"topic": "welding"}
+        assert cache.lookup("anthropology fundamentals course") is None
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class Transcript:
+    """Columnar, immutable transcript
+
+    Segment start times and durations are float64 arrays and all segment text
+    lives in one string, `full_text`, in which segment i occupies
+    `full_text[offsets[i]:offsets[i + 1] - 1]` (segments are joined by single
+    spaces). Compared to a list of {"text", "start", "duration"} dicts this
+    takes a fraction of the memory, `full_text` needs no join, and lookups by
+    time or by text offset are binary searches. Segments must be sorted by
+    start time, which YouTube transcripts are.
+    """
+
+    __slots__ = ("starts", "durations", "full_text", "offsets")
+
+    def __init__(self, starts, durations, full_text, offsets):
+        self.starts = starts
+        self.durations = durations
+        self.full_text = full_text
+        self.offsets = offsets
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Build from a list of {"text", "start", "duration"} dicts"""
+        texts = [item["text"] for item in segments]
+        lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(
+            np.fromiter((item["start"] for item in segments), dtype=np.float64, count=len(segments)),
+            np.fromiter((item.get("duration", 0) for item in segments), dtype=np.float64, count=len(segments)),
+            " ".join(texts),
+            offsets
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        """Segment `i` as a {"text", "start", "duration"} dict"""
+        return {"text": self.text(i), "start": float(self.starts[i]), "duration": float(self.durations[i])}
+
+    def text(self, i, j=None):
+        """Text of segment i, or of segments i..j-1 joined by spaces"""
+        j = i + 1 if j is None else j
+        if j <= i:
+            return ""
+        return self.full_text[self.offsets[i]:self.offsets[j] - 1]
+
+    @property
+    def ends(self):
+        return self.starts + self.durations
+
+    @property
+    def end_time(self):
+        return float(self.ends.max()) if len(self) else 0.0
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.durations.nbytes + self.offsets.nbytes + len(self.full_text)
+
+    def segment_at(self, seconds):
+        """Index of the last segment starting at or before `seconds` (-1 if none)"""
+        return int(np.searchsorted(self.starts, seconds, side="right")) - 1
+
+    def segment_for_offset(self, offset):
+        """Index of the segment containing character `offset` of `full_text`"""
+        return int(np.searchsorted(self.offsets, offset, side="right")) - 1
+
+    def slice(self, start=None, end=None):
+        """Segments overlapping [start, end) seconds, as a new Transcript sharing the arrays"""
+        if start is None and end is None:
+            return self
+
+        lo = 0
+        if start is not None:
+            # Include the segment that is still playing at `start`
+            lo = max(self.segment_at(start), 0)
+            if lo < len(self) and self.starts[lo] + self.durations[lo] <= start:
+                lo += 1
+        hi = len(self) if end is None else int(np.searchsorted(self.starts, end, side="left"))
+        return self.take(lo, max(hi, lo))
+
+    def take(self, lo, hi):
+        """Segments lo..hi-1 as a new Transcript"""
+        offsets = self.offsets[lo:hi + 1] - self.offsets[lo]
+        return Transcript(self.starts[lo:hi], self.durations[lo:hi], self.text(lo, hi), offsets)
+
+    def to_segments(self):
+        """List of {"text", "start", "duration"} dicts, the youtube_transcript_api format"""
+        return [self[i] for i in range(len(self))]
+
+    def to_columnar(self):
+        """Parallel arrays instead of one dict per segment; avoids repeating keys per row"""
+        return {
+            "text": [self.text(i) for i in range(len(self))],
+            "start": self.starts.tolist(),
+            "duration": self.durations.tolist(),
+        }
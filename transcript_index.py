@@ -0,0 +1,221 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+VIDEO_ID_PATTERN = re.compile(r"[0-9A-Za-z_-]{11}")
+
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had
+has have having he her here hers him his how i if in into is it its itself just me more most
+my no nor not now of off on once only or other our ours out over own same she should so some
+such than that the their them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your
+video lecture talk
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def format_timestamp(seconds):
+    """Format seconds as HH:MM:SS"""
+    return time.strftime('%H:%M:%S', time.gmtime(seconds))
+
+
+def chunk_transcript(transcript, window_seconds=60.0, overlap_seconds=15.0):
+    """Group the segments of a Transcript into overlapping time-windowed passages"""
+    passages = []
+    if not len(transcript):
+        return passages
+
+    step = max(window_seconds - overlap_seconds, 1.0)
+    end_of_video = transcript.end_time
+    window_start = float(transcript.starts[0])
+
+    while window_start < end_of_video:
+        # Segments starting inside the window are contiguous, and their text
+        # is one slice of full_text
+        lo = int(np.searchsorted(transcript.starts, window_start, side="left"))
+        hi = int(np.searchsorted(transcript.starts, window_start + window_seconds, side="left"))
+        if lo >= len(transcript):
+            break
+        if hi > lo:
+            passages.append({
+                "start": float(transcript.starts[lo]),
+                "end": float(transcript.starts[hi - 1] + transcript.durations[hi - 1]),
+                "text": transcript.text(lo, hi),
+            })
+        window_start += step
+
+    return passages
+
+
+class TranscriptIndex:
+    """BM25 index over the passages of one transcript
+
+    Postings are stored CSR-style in flat NumPy arrays (term_ptr, doc_ids, tfs)
+    so the index serialises to a single .npz without pickling.
+    """
+
+    def __init__(self, passages, vocab, term_ptr, doc_ids, tfs, doc_len, k1=1.5, b=0.75):
+        self.passages = passages
+        self.vocab = vocab
+        self.term_ptr = term_ptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+
+        n_docs = len(passages)
+        self.avg_len = float(doc_len.mean()) if n_docs else 0.0
+        df = np.diff(term_ptr).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, transcript, window_seconds=60.0, overlap_seconds=15.0):
+        passages = chunk_transcript(transcript, window_seconds, overlap_seconds)
+        counts = [Counter(tokenize(p["text"])) for p in passages]
+
+        vocab = {}
+        for counter in counts:
+            for term in counter:
+                vocab.setdefault(term, len(vocab))
+
+        postings = [[] for _ in vocab]
+        for doc_id, counter in enumerate(counts):
+            for term, tf in counter.items():
+                postings[vocab[term]].append((doc_id, tf))
+
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int32)
+        term_ptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.fromiter((d for p in postings for d, _ in p), dtype=np.int32, count=int(term_ptr[-1]))
+        tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float32, count=int(term_ptr[-1]))
+        doc_len = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+
+        return cls(passages, vocab, term_ptr, doc_ids, tfs, doc_len)
+
+    def search(self, query, k=5):
+        """Return the top-k passages for `query` with their BM25 scores
+
+        When no query term occurs in the transcript (e.g. "what is this
+        about?"), passages spread evenly across the video are returned instead.
+        """
+        n_docs = len(self.passages)
+        if n_docs == 0:
+            return []
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / (self.avg_len or 1.0))
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            lo, hi = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            docs = self.doc_ids[lo:hi]
+            tf = self.tfs[lo:hi]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm[docs])
+
+        k = min(k, n_docs)
+        if not scores.any():
+            top = np.unique(np.linspace(0, n_docs - 1, k).astype(int))
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[scores[top] > 0]
+            top = top[np.argsort(-scores[top])]
+
+        return [{**self.passages[i], "score": float(scores[i])} for i in top]
+
+    def save(self, path):
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        np.savez_compressed(
+            path,
+            passages=np.array(json.dumps(self.passages)),
+            terms=np.array(json.dumps(terms)),
+            term_ptr=self.term_ptr,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_len=self.doc_len,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            terms = json.loads(str(data["terms"]))
+            return cls(
+                json.loads(str(data["passages"])),
+                {term: i for i, term in enumerate(terms)},
+                data["term_ptr"],
+                data["doc_ids"],
+                data["tfs"],
+                data["doc_len"],
+            )
+
+
+class TranscriptIndexStore:
+    """Per-video index cache: built once, persisted to disk, kept hot in an LRU
+
+    `index_cls` is any index with `build(transcript)`, `save(path)` and
+    `load(path)`; TranscriptIndex by default.
+    """
+
+    def __init__(self, directory, max_in_memory=256, index_cls=None):
+        self.directory = directory
+        self.max_in_memory = max_in_memory
+        self.index_cls = index_cls or TranscriptIndex
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._memory = OrderedDict()
+
+    def get(self, video_id, load_transcript):
+        """Return the index for `video_id`, building it from `load_transcript(video_id)` if needed"""
+        if not isinstance(video_id, str) or not VIDEO_ID_PATTERN.fullmatch(video_id):
+            raise ValueError(f"Invalid video ID: {video_id!r}")
+
+        index = self._from_memory(video_id)
+        if index is not None:
+            return index
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(video_id, threading.Lock())
+
+        with build_lock:
+            index = self._from_memory(video_id)
+            if index is not None:
+                return index
+
+            path = os.path.join(self.directory, f"{video_id}.npz")
+            if os.path.exists(path):
+                index = self.index_cls.load(path)
+            else:
+                index = self.index_cls.build(load_transcript(video_id))
+                tmp_path = f"{path}.{threading.get_ident()}.tmp.npz"
+                index.save(tmp_path)
+                os.replace(tmp_path, path)
+
+            with self._lock:
+                self._memory[video_id] = index
+                while len(self._memory) > self.max_in_memory:
+                    self._memory.popitem(last=False)
+                self._build_locks.pop(video_id, None)
+            return index
+
+    def _from_memory(self, video_id):
+        with self._lock:
+            index = self._memory.get(video_id)
+            if index is not None:
+                self._memory.move_to_end(video_id)
+            return index
@@ -0,0 +1,180 @@
+import json
+import re
+
+import numpy as np
+
+from transcript import Transcript
+from transcript_index import STOPWORDS, TOKEN_PATTERN, format_timestamp
+
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+
+# Score multiplier for an exact phrase occurrence relative to its words appearing separately
+PHRASE_BOOST = 3.0
+
+
+def parse_query(query):
+    """Split a query into phrases (token lists) and keywords
+
+    Quoted parts are phrases and only match exactly; unquoted words are
+    keywords. An unquoted query of several words is also tried as a phrase,
+    so exact occurrences rank above scattered words.
+    """
+    phrases = [TOKEN_PATTERN.findall(p.lower()) for p in PHRASE_PATTERN.findall(query)]
+    rest = TOKEN_PATTERN.findall(PHRASE_PATTERN.sub(" ", query).lower())
+    if not phrases and len(rest) > 1:
+        phrases.append(rest)
+    keywords = list(dict.fromkeys(t for t in rest if t not in STOPWORDS))
+    # A quoted single word is just a keyword
+    keywords += [p[0] for p in phrases if len(p) == 1 and p[0] not in keywords]
+    return [p for p in phrases if len(p) > 1], keywords
+
+
+class PhraseIndex:
+    """Positional inverted index over one transcript
+
+    Every token of the transcript gets a global position, so phrases match
+    across caption boundaries. Postings are CSR-style NumPy arrays (term_ptr,
+    positions), and `token_segment` maps a position back to its segment, so
+    a phrase query is a handful of sorted-array intersections.
+    """
+
+    def __init__(self, transcript, vocab, term_ptr, positions, token_segment):
+        self.transcript = transcript
+        self.vocab = vocab
+        self.term_ptr = term_ptr
+        self.positions = positions
+        self.token_segment = token_segment
+
+        # Segment frequency per term for IDF: count distinct (term, segment) pairs
+        n_segments = max(len(transcript), 1)
+        posting_terms = np.repeat(np.arange(len(vocab), dtype=np.int64), np.diff(term_ptr))
+        pairs = np.unique(posting_terms * n_segments + token_segment[positions])
+        segment_df = np.bincount(pairs // n_segments, minlength=len(vocab)).astype(np.float32)
+        self.idf = np.log(1.0 + n_segments / np.maximum(segment_df, 1.0)).astype(np.float32)
+
+    @classmethod
+    def build(cls, transcript):
+        vocab = {}
+        term_ids = []
+        token_segment = []
+        for i in range(len(transcript)):
+            for token in TOKEN_PATTERN.findall(transcript.text(i).lower()):
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+                token_segment.append(i)
+
+        term_ids = np.array(term_ids, dtype=np.int32)
+        # A stable sort by term keeps each term's positions in ascending order
+        order = np.argsort(term_ids, kind="stable").astype(np.int32)
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int32)
+        term_ptr[1:] = np.cumsum(np.bincount(term_ids, minlength=len(vocab)))
+        return cls(transcript, vocab, term_ptr, order, np.array(token_segment, dtype=np.int32))
+
+    def search(self, query, k=10):
+        """Ranked segments matching the phrases and keywords of `query`"""
+        phrases, keywords = parse_query(query)
+        n_segments = len(self.transcript)
+        if n_segments == 0:
+            return []
+
+        scores = np.zeros(n_segments, dtype=np.float32)
+        # Last segment of the best-scoring match starting in each segment
+        span_end = np.arange(n_segments, dtype=np.int32)
+        phrase_hits = np.zeros(n_segments, dtype=bool)
+
+        for phrase in phrases:
+            starts = self.phrase_positions(phrase)
+            if len(starts) == 0:
+                continue
+            first = self.token_segment[starts]
+            last = self.token_segment[starts + len(phrase) - 1]
+            weight = PHRASE_BOOST * sum(self.idf[self.vocab[t]] for t in phrase)
+            np.add.at(scores, first, weight)
+            np.maximum.at(span_end, first, last)
+            phrase_hits[first] = True
+
+        for term in keywords:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            segments = self.token_segment[self._postings(term_id)]
+            counts = np.bincount(segments, minlength=n_segments).astype(np.float32)
+            hit = counts > 0
+            scores[hit] += self.idf[term_id] * (1 + np.log(counts[hit]))
+
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        k = min(k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for segment in top:
+            end_segment = int(span_end[segment])
+            start = float(self.transcript.starts[segment])
+            results.append({
+                "start": start,
+                "end": float(self.transcript.starts[end_segment] + self.transcript.durations[end_segment]),
+                "timestamp": format_timestamp(start),
+                "text": self.transcript.text(int(segment), end_segment + 1),
+                "score": float(scores[segment]),
+                "phrase_match": bool(phrase_hits[segment]),
+            })
+        return results
+
+    def count_matches(self, query):
+        """Number of segments matching any phrase or keyword of `query`"""
+        phrases, keywords = parse_query(query)
+        hit = np.zeros(len(self.transcript), dtype=bool)
+        for phrase in phrases:
+            hit[self.token_segment[self.phrase_positions(phrase)]] = True
+        for term in keywords:
+            term_id = self.vocab.get(term)
+            if term_id is not None:
+                hit[self.token_segment[self._postings(term_id)]] = True
+        return int(hit.sum())
+
+    def phrase_positions(self, tokens):
+        """Global positions where the token sequence `tokens` starts"""
+        candidates = None
+        for offset, token in enumerate(tokens):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                return np.zeros(0, dtype=np.int32)
+            shifted = self._postings(term_id) - offset
+            candidates = shifted if candidates is None else np.intersect1d(candidates, shifted, assume_unique=True)
+            if len(candidates) == 0:
+                break
+        return candidates
+
+    def _postings(self, term_id):
+        return self.positions[self.term_ptr[term_id]:self.term_ptr[term_id + 1]]
+
+    def save(self, path):
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        np.savez_compressed(
+            path,
+            terms=np.array(json.dumps(terms)),
+            term_ptr=self.term_ptr,
+            positions=self.positions,
+            token_segment=self.token_segment,
+            starts=self.transcript.starts,
+            durations=self.transcript.durations,
+            full_text=np.array(self.transcript.full_text),
+            offsets=self.transcript.offsets,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            terms = json.loads(str(data["terms"]))
+            transcript = Transcript(data["starts"], data["durations"], str(data["full_text"]), data["offsets"])
+            return cls(
+                transcript,
+                {term: i for i, term in enumerate(terms)},
+                data["term_ptr"],
+                data["positions"],
+                data["token_segment"],
+            )
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+
+class TranscriptStore:
+    """Persistent, content-addressed transcript cache backed by SQLite
+
+    Transcripts are stored once per unique content hash in the `blobs` table and
+    referenced from `videos` by video id, so re-uploads and mirrors of the same
+    lecture share storage. Concurrent fetches for the same video are coalesced
+    into a single upstream call.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db_lock = threading.Lock()
+        self._inflight_lock = threading.Lock()
+        self._inflight = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                hash TEXT NOT NULL REFERENCES blobs(hash),
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS videos_accessed ON videos(accessed_at);
+        """)
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    # ----- public API -----
+
+    def get(self, video_id, fetch):
+        """Return the transcript for `video_id`, calling `fetch(video_id)` on a miss"""
+        transcript = self._load(video_id)
+        if transcript is not None:
+            self.hits += 1
+            return transcript
+
+        with self._inflight_lock:
+            future = self._inflight.get(video_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[video_id] = future
+
+        if not owner:
+            self.coalesced += 1
+            return future.result()
+
+        self.misses += 1
+        try:
+            transcript = fetch(video_id)
+            self.put(video_id, transcript)
+            future.set_result(transcript)
+            return transcript
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(video_id, None)
+
+    def put(self, video_id, transcript):
+        """Store a transcript and evict expired or excess entries"""
+        raw = json.dumps(transcript, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        data = zlib.compress(raw)
+        now = time.time()
+
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)",
+                (digest, data, len(data))
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO videos (video_id, hash, fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (video_id, digest, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def invalidate(self, video_id):
+        """Drop a cached transcript"""
+        with self._db_lock:
+            self._conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+            self._collect_blobs()
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and storage usage"""
+        with self._db_lock:
+            videos, = self._conn.execute("SELECT COUNT(*) FROM videos").fetchone()
+            blobs, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "videos": videos,
+            "blobs": blobs,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    # ----- internals -----
+
+    def _load(self, video_id):
+        now = time.time()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT b.data, v.fetched_at FROM videos v JOIN blobs b ON b.hash = v.hash WHERE v.video_id = ?",
+                (video_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            data, fetched_at = row
+            if self.ttl_seconds and now - fetched_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+                self._collect_blobs()
+                self._conn.commit()
+                self.evictions += 1
+                return None
+
+            self._conn.execute("UPDATE videos SET accessed_at = ? WHERE video_id = ?", (now, video_id))
+            self._conn.commit()
+
+        return json.loads(zlib.decompress(data))
+
+    def _evict(self, now):
+        """Expire entries past their TTL, then drop least recently used ones over the size budget"""
+        if self.ttl_seconds:
+            cursor = self._conn.execute("DELETE FROM videos WHERE fetched_at < ?", (now - self.ttl_seconds,))
+            self.evictions += cursor.rowcount
+        self._collect_blobs()
+
+        if not self.max_bytes:
+            return
+
+        total, = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        while total > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT video_id FROM videos ORDER BY accessed_at ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM videos WHERE video_id = ?", row)
+            self.evictions += 1
+            self._collect_blobs()
+            total, = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()
+
+    def _collect_blobs(self):
+        """Remove blobs no longer referenced by any video"""
+        self._conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM videos)")